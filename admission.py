@@ -0,0 +1,137 @@
+import math
+# 导入日志配置
+from logger_config import logger
+from scheduler import PRIORITY_INTERACTIVE, PRIORITY_BATCH, PRIORITY_SAMPLE, PRIORITY_CLASSES
+
+
+class AdmissionController:
+    """基于实时容量信号的准入控制
+
+    为每个优先级类别分别计算负载水位（1.0表示满载），取以下信号的最大值：
+    - 在途合成数：运行中的请求数加上本类别及更高优先级类别的排队数 / 可容纳的请求数
+    - 排队等待：本类别及更高优先级类别中排队最久的请求已等待时间 / 目标等待时间
+    - 上游延迟：最近一段时间主引擎成功请求的首块延迟p95 / 目标延迟
+    低优先级请求会被调度器有意延后，它们的排队不计入高优先级类别的负载，
+    因此批量和样本请求积压不会导致拒绝交互式请求。
+    负载水位达到某个优先级类别的拒绝水位时，该类别的新请求直接返回503，
+    低优先级类别的拒绝水位更低，因此过载时先拒绝样本请求，其次批量请求。
+
+    所有节点共用同一上游，上游变慢时如果拒绝交互式请求，所有节点会同时退出负载均衡，
+    因此上游延迟信号最多只用于拒绝低优先级请求（不超过 UPSTREAM_LOAD_CAP）；
+    配置了降级引擎时由降级引擎应对上游变慢，不使用该信号。
+    """
+
+    # 各优先级类别开始拒绝新请求的负载水位
+    DEFAULT_SHED_LEVELS = {
+        PRIORITY_SAMPLE: 0.6,
+        PRIORITY_BATCH: 0.8,
+        PRIORITY_INTERACTIVE: 1.0,
+    }
+    # 上游延迟信号能达到的最大负载水位，低于交互式请求的拒绝水位
+    UPSTREAM_LOAD_CAP = 0.9
+
+    def __init__(self, scheduler, router=None, queue_per_slot=2.0, target_queue_wait=5.0,
+                 target_upstream_latency=5.0, latency_window=30.0, min_latency_samples=10, shed_levels=None):
+        """初始化准入控制器
+
+        参数:
+            scheduler (RequestScheduler): 合成请求调度器
+            router (EngineRouter): 合成引擎路由，用于读取上游延迟，None表示不使用该信号
+            queue_per_slot (float): 每个合成槽位允许排队的请求数
+            target_queue_wait (float): 目标排队等待时间（秒）
+            target_upstream_latency (float): 目标上游首块延迟（秒）
+            latency_window (float): 统计上游延迟的时间窗口（秒）
+            min_latency_samples (int): 使用上游延迟信号所需的最少样本数
+            shed_levels (dict): 各优先级类别的拒绝水位，未配置的使用默认值
+        """
+        self.scheduler = scheduler
+        self.router = router
+        self.queue_per_slot = queue_per_slot
+        self.target_queue_wait = target_queue_wait
+        self.target_upstream_latency = target_upstream_latency
+        self.latency_window = latency_window
+        self.min_latency_samples = min_latency_samples
+        self.shed_levels = dict(self.DEFAULT_SHED_LEVELS)
+        self.shed_levels.update(shed_levels or {})
+        self.rejected = {name: 0 for name in PRIORITY_CLASSES}
+
+    def _signals(self, priority, stats=None):
+        """采集某个优先级类别的容量信号，只统计该类别及更高优先级类别的排队情况"""
+        if stats is None:
+            stats = self.scheduler.get_stats()
+        ahead = PRIORITY_CLASSES[:PRIORITY_CLASSES.index(priority) + 1]
+        classes = [stats["classes"][name] for name in ahead]
+        queued = sum(c["queue_depth"] for c in classes)
+        capacity = stats["max_concurrent"] * (1 + self.queue_per_slot)
+        oldest_wait = max(c["oldest_wait_ms"] for c in classes) / 1000
+        upstream_latency = 0.0
+        if self.router is not None and self.router.fallback is None:
+            upstream_latency = self.router.recent_latency(self.latency_window, min_samples=self.min_latency_samples)
+        return {
+            "running": stats["running"],
+            "queued": queued,
+            "max_concurrent": stats["max_concurrent"],
+            "in_flight_load": (stats["running"] + queued) / capacity,
+            "oldest_queue_wait": round(oldest_wait, 3),
+            "queue_wait_load": oldest_wait / self.target_queue_wait,
+            "upstream_latency_p95": round(upstream_latency, 3),
+            "upstream_latency_load": min(upstream_latency / self.target_upstream_latency, self.UPSTREAM_LOAD_CAP),
+        }
+
+    @staticmethod
+    def _load(signals):
+        return max(signals["in_flight_load"], signals["queue_wait_load"], signals["upstream_latency_load"])
+
+    def _retry_after(self, signals):
+        """估算客户端应在多少秒后重试"""
+        per_request = max(1.0, signals["upstream_latency_p95"], signals["oldest_queue_wait"])
+        batches = max(1.0, signals["queued"] / signals["max_concurrent"])
+        return int(math.ceil(per_request * batches))
+
+    def admit(self, priority):
+        """判断是否接受一个新请求
+
+        参数:
+            priority (str): 请求的优先级类别
+
+        返回:
+            tuple: (是否接受, 建议重试间隔秒数)
+        """
+        signals = self._signals(priority)
+        load = self._load(signals)
+        if load < self.shed_levels[priority]:
+            return True, 0
+        self.rejected[priority] += 1
+        retry_after = self._retry_after(signals)
+        logger.warning(f"准入控制拒绝请求: 类别={priority}, 负载={load:.2f}, 建议{retry_after}秒后重试")
+        return False, retry_after
+
+    def get_status(self):
+        """获取当前准入状态
+
+        返回:
+            dict: 状态（ok/degraded/overloaded）、交互式请求的负载水位和各信号、
+                各类别的负载水位及正在拒绝的类别
+        """
+        stats = self.scheduler.get_stats()
+        signals = {name: self._signals(name, stats) for name in PRIORITY_CLASSES}
+        loads = {name: self._load(signals[name]) for name in PRIORITY_CLASSES}
+        shedding = [name for name in PRIORITY_CLASSES if loads[name] >= self.shed_levels[name]]
+        if PRIORITY_INTERACTIVE in shedding:
+            state = "overloaded"
+        elif shedding:
+            state = "degraded"
+        else:
+            state = "ok"
+        return {
+            "state": state,
+            "ready": PRIORITY_INTERACTIVE not in shedding,
+            "load": round(loads[PRIORITY_INTERACTIVE], 3),
+            "signals": {key: round(value, 3) if isinstance(value, float) else value
+                        for key, value in signals[PRIORITY_INTERACTIVE].items()},
+            "class_loads": {name: round(load, 3) for name, load in loads.items()},
+            "shedding": shedding,
+            # 正在拒绝的最高优先级类别的重试间隔（就绪检查失败时即交互式请求的重试间隔）
+            "retry_after": self._retry_after(signals[shedding[0]]) if shedding else 0,
+            "rejected": dict(self.rejected),
+        }
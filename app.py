@@ -1,11 +1,25 @@
-from flask import Flask, request, jsonify, send_file, abort, render_template, send_from_directory
+from flask import Flask, request, jsonify, send_file, abort, render_template, send_from_directory, g, redirect
 import os
 from tts_service import TTSService
+from text_normalizer import TextNormalizer, TextValidationError
+from hedging import HedgePolicy
+from engines import EdgeTTSEngine, EspeakEngine, EngineRouter
+from storage import LocalStorage, S3Storage
+from tracing import start_trace, end_trace, current_trace, use_trace
+from profiler import SamplingProfiler, ProfilerBusyError
+from incremental_tts import SentenceSegmenter, IncrementalSynthesizer
+from admission import AdmissionController
+from scheduler import (RequestScheduler, SchedulerTimeoutError,
+                       PRIORITY_INTERACTIVE, PRIORITY_BATCH, PRIORITY_SAMPLE)
 from flask import Response
 import asyncio
-from functools import wraps
+import json
+import math
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
 # 导入日志配置
-from logger_config import logger, access_logger, tts_logger
+from logger_config import logger, access_logger, tts_logger, trace_logger
 
 # 尝试导入并配置CORS
 try:
@@ -14,14 +28,24 @@ try:
 except ImportError:
     CORS_INSTALLED = False
 
+# 尝试导入WebSocket支持（用于增量文本合成接口）
+try:
+    from flask_sock import Sock
+    SOCK_INSTALLED = True
+except ImportError:
+    SOCK_INSTALLED = False
+
 app = Flask(__name__)
-# 初始化TTS服务
-tts_service = TTSService()
 
 # 如果安装了flask_cors，则配置CORS
 if CORS_INSTALLED:
     CORS(app, origins="*")
     logger.info("已启用CORS支持")
+
+# 如果安装了flask_sock，则启用WebSocket支持
+if SOCK_INSTALLED:
+    sock = Sock(app)
+    logger.info("已启用WebSocket支持")
 # 安全配置
 # 从环境变量读取配置，如果环境变量不存在则使用默认值
 # API密钥 - 可以使用generate_api_key()生成一个新的密钥
@@ -30,6 +54,51 @@ API_KEY = os.environ.get("API_KEY", "4b7c9e2a-3d8f-5a1b-6c4d-7e8f9a0b1c2d")  # 
 # 环境变量格式：逗号分隔的IP列表，如"192.168.1.100,127.0.0.1"
 allowed_ips_str = os.environ.get("ALLOWED_IPS", "")
 ALLOWED_IPS = [ip.strip() for ip in allowed_ips_str.split(",")] if allowed_ips_str else []
+# 管理员密钥 - 用于访问 /api/admin/ 下的管理接口，未配置时管理接口禁用
+ADMIN_API_KEY = os.environ.get("ADMIN_API_KEY", "")
+
+# 追踪配置
+# 是否将每个请求的阶段耗时写入追踪日志
+TRACE_LOG_ENABLED = os.environ.get("TTS_TRACE_LOG", "false").lower() == "true"
+
+# 调度配置
+# 同时进行的上游合成数量上限
+MAX_CONCURRENT_SYNTHESIS = int(os.environ.get("TTS_MAX_CONCURRENT", "4"))
+# 低优先级请求的最长等待时间（秒），超过后优先调度，防止饿死
+STARVATION_TIMEOUT = float(os.environ.get("TTS_STARVATION_TIMEOUT", "10"))
+# 排队超时时间（秒），为空表示不超时
+queue_timeout_str = os.environ.get("TTS_QUEUE_TIMEOUT", "")
+QUEUE_TIMEOUT = float(queue_timeout_str) if queue_timeout_str else None
+# 客户端权重，格式："客户端地址1:权重,客户端地址2:权重"，未配置的客户端权重为1
+client_weights_str = os.environ.get("TTS_CLIENT_WEIGHTS", "")
+CLIENT_WEIGHTS = {}
+for item in client_weights_str.split(","):
+    if ":" in item:
+        weight_key, weight_value = item.rsplit(":", 1)
+        CLIENT_WEIGHTS[weight_key.strip()] = float(weight_value)
+
+# WebSocket增量合成时同时合成的最大句子数
+INCREMENTAL_PREFETCH = int(os.environ.get("TTS_INCREMENTAL_PREFETCH", "2"))
+
+# 批量接口中并发执行的合成任务数（实际并发仍受调度器限制）
+BATCH_WORKERS = int(os.environ.get("TTS_BATCH_WORKERS", "4"))
+
+# 初始化合成请求调度器
+scheduler = RequestScheduler(
+    max_concurrent=MAX_CONCURRENT_SYNTHESIS,
+    starvation_timeout=STARVATION_TIMEOUT,
+    key_weights=CLIENT_WEIGHTS,
+    queue_timeout=QUEUE_TIMEOUT
+)
+
+# 对冲配置
+# 是否启用上游对冲请求
+HEDGE_ENABLED = os.environ.get("TTS_HEDGE_ENABLED", "false").lower() == "true"
+# 对冲阈值（秒），为空表示根据观测到的首块延迟p95动态计算
+hedge_delay_str = os.environ.get("TTS_HEDGE_DELAY", "")
+HEDGE_DELAY = float(hedge_delay_str) if hedge_delay_str else None
+# 对冲请求占总请求的最大比例
+HEDGE_BUDGET = float(os.environ.get("TTS_HEDGE_BUDGET", "0.1"))
 
 # 配置文件上传目录
 UPLOAD_FOLDER = 'output'
@@ -43,12 +112,157 @@ if not os.path.exists(UPLOAD_FOLDER):
     except Exception as e:
         logger.error(f"创建上传目录失败: {str(e)}")
 
-# 将异步函数转换为同步函数的装饰器
-def async_to_sync(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        return asyncio.run(f(*args, **kwargs))
-    return decorated_function
+# 存储配置
+# 音频存储后端：local（本地output目录）或s3（S3兼容对象存储，如MinIO）
+STORAGE_BACKEND = os.environ.get("TTS_STORAGE", "local").lower()
+if STORAGE_BACKEND == "s3":
+    audio_storage = S3Storage(
+        bucket=os.environ.get("S3_BUCKET", "tts-audio"),
+        prefix=os.environ.get("S3_PREFIX", ""),
+        endpoint_url=os.environ.get("S3_ENDPOINT_URL") or None,
+        region=os.environ.get("S3_REGION") or None,
+        access_key=os.environ.get("S3_ACCESS_KEY") or None,
+        secret_key=os.environ.get("S3_SECRET_KEY") or None,
+        url_expires=int(os.environ.get("S3_URL_EXPIRES", "3600")),
+        public_base_url=os.environ.get("S3_PUBLIC_BASE_URL") or None
+    )
+else:
+    audio_storage = LocalStorage(UPLOAD_FOLDER)
+
+# 合成引擎配置
+# 降级引擎：espeak（本地离线合成，需要安装espeak-ng和ffmpeg），为空表示不降级
+FALLBACK_ENGINE = os.environ.get("TTS_FALLBACK_ENGINE", "").lower()
+# 始终使用降级引擎的语音模型，逗号分隔
+offline_voices_str = os.environ.get("TTS_OFFLINE_VOICES", "")
+OFFLINE_VOICES = [v.strip() for v in offline_voices_str.split(",") if v.strip()]
+# 触发降级的主引擎错误率和首块延迟p95（秒）
+FALLBACK_ERROR_RATE = float(os.environ.get("TTS_FALLBACK_ERROR_RATE", "0.5"))
+FALLBACK_LATENCY = float(os.environ.get("TTS_FALLBACK_LATENCY", "5"))
+# 降级持续时间（秒），之后重新尝试主引擎
+FALLBACK_COOLDOWN = float(os.environ.get("TTS_FALLBACK_COOLDOWN", "30"))
+# 等待首个音频数据块的超时时间（秒），超时视为失败，为空表示不超时
+first_chunk_timeout_str = os.environ.get("TTS_FIRST_CHUNK_TIMEOUT", "15")
+FIRST_CHUNK_TIMEOUT = float(first_chunk_timeout_str) if first_chunk_timeout_str else None
+
+engine_router = EngineRouter(
+    EdgeTTSEngine(),
+    fallback=EspeakEngine() if FALLBACK_ENGINE == "espeak" else None,
+    offline_voices=OFFLINE_VOICES,
+    error_rate_threshold=FALLBACK_ERROR_RATE,
+    latency_threshold=FALLBACK_LATENCY,
+    cooldown=FALLBACK_COOLDOWN
+)
+
+# 文本预处理配置
+# 规范化后允许的最大文本长度（字符）
+MAX_TEXT_LENGTH = int(os.environ.get("TTS_MAX_TEXT_LENGTH", "10000"))
+# 文本预处理结果的LRU缓存条目数
+NORMALIZE_CACHE_SIZE = int(os.environ.get("TTS_NORMALIZE_CACHE_SIZE", "1024"))
+
+# 初始化TTS服务
+tts_service = TTSService(
+    hedge_policy=HedgePolicy(
+        enabled=HEDGE_ENABLED,
+        delay=HEDGE_DELAY,
+        budget_ratio=HEDGE_BUDGET
+    ),
+    storage=audio_storage,
+    router=engine_router,
+    first_chunk_timeout=FIRST_CHUNK_TIMEOUT,
+    normalizer=TextNormalizer(max_length=MAX_TEXT_LENGTH, cache_size=NORMALIZE_CACHE_SIZE)
+)
+
+# 准入控制配置
+# 每个合成槽位允许排队的请求数，运行和排队的请求总数超过 并发数×(1+该值) 时视为满载
+ADMISSION_QUEUE_PER_SLOT = float(os.environ.get("TTS_ADMISSION_QUEUE_PER_SLOT", "2"))
+# 目标排队等待时间（秒），排队最久的请求等待超过该值时视为满载
+ADMISSION_QUEUE_WAIT = float(os.environ.get("TTS_ADMISSION_QUEUE_WAIT", "5"))
+# 目标上游首块延迟（秒），最近30秒主引擎首块延迟p95超过该值时视为满载
+ADMISSION_UPSTREAM_LATENCY = float(os.environ.get("TTS_ADMISSION_UPSTREAM_LATENCY", "5"))
+# 样本请求和批量请求开始被拒绝的负载水位（交互式请求在满载时才拒绝）
+ADMISSION_SHED_SAMPLE = float(os.environ.get("TTS_ADMISSION_SHED_SAMPLE", "0.6"))
+ADMISSION_SHED_BATCH = float(os.environ.get("TTS_ADMISSION_SHED_BATCH", "0.8"))
+
+admission = AdmissionController(
+    scheduler,
+    router=engine_router,
+    queue_per_slot=ADMISSION_QUEUE_PER_SLOT,
+    target_queue_wait=ADMISSION_QUEUE_WAIT,
+    target_upstream_latency=ADMISSION_UPSTREAM_LATENCY,
+    shed_levels={PRIORITY_SAMPLE: ADMISSION_SHED_SAMPLE, PRIORITY_BATCH: ADMISSION_SHED_BATCH}
+)
+
+# 需要准入控制的接口及其优先级类别
+ADMISSION_ROUTES = {
+    '/api/tts': PRIORITY_INTERACTIVE,
+    '/api/tts/stream': PRIORITY_INTERACTIVE,
+    '/api/tts/ws': PRIORITY_INTERACTIVE,
+    '/api/tts/batch': PRIORITY_BATCH,
+    '/api/voice_sample': PRIORITY_SAMPLE,
+}
+
+# 初始化采样分析器
+profiler = SamplingProfiler()
+
+# 将异步生成器转换为同步生成器，使流式响应可以在WSGI中逐块输出
+def async_gen_to_sync(agen):
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(agen.aclose())
+        # 关闭提前中止时仍未结束的内层异步生成器（如上游连接）
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+def build_file_url(file_name, host_url):
+    """生成音频文件的访问地址
+    
+    存储后端有长期有效的公开地址时直接返回，否则返回本服务的 /static/audio/ 地址
+    （非本地存储时该地址会重定向到预签名地址）
+    """
+    return audio_storage.public_url(file_name) or f"{host_url}static/audio/{file_name}"
+
+def send_audio(file_name, as_attachment=False):
+    """返回音频文件：本地存储直接发送文件，其他存储重定向到存储服务，避免由本服务转发音频数据"""
+    file_path = audio_storage.local_path(file_name)
+    if file_path is None:
+        return redirect(audio_storage.get_url(file_name))
+    response = send_file(
+        file_path,
+        mimetype='audio/mpeg',
+        as_attachment=as_attachment,
+        download_name=file_name if as_attachment else None
+    )
+    # 文件内容在视图返回、响应头发出之后才开始传输，传输耗时在响应关闭时记录，
+    # 因此只出现在追踪日志中，不包含在Server-Timing响应头里，仅在启用追踪日志时记录
+    trace = current_trace()
+    if TRACE_LOG_ENABLED and trace is not None:
+        enable_close_callbacks(response)
+        started = time.perf_counter()
+        response.call_on_close(
+            lambda: trace.add_span("file_transfer", time.perf_counter() - started, start=started))
+    return response
+
+def enable_close_callbacks(response):
+    """使文件响应在传输结束时执行 call_on_close 注册的回调
+
+    direct_passthrough 的响应由WSGI服务器直接迭代文件（可使用sendfile），不会执行这些回调；
+    关闭后按普通流式响应返回，会失去sendfile，因此只在启用追踪日志时调用
+    """
+    response.direct_passthrough = False
+
+def get_client_id():
+    """获取调度时公平共享使用的客户端标识
+
+    服务只有一个API密钥，通过认证的请求密钥都相同，因此按客户端地址区分；
+    不使用请求中未经验证的X-API-Key，避免客户端伪造任意多的标识
+    """
+    return request.remote_addr or "anonymous"
 
 # 请求日志记录中间件
 def log_request_middleware():
@@ -62,11 +276,22 @@ def log_request_middleware():
     # 记录访问日志
     access_logger.info(f"请求: IP={client_ip}, 方法={method}, 路径={path}, UA={user_agent}")
 
+# 请求追踪中间件
+def trace_request_middleware():
+    """为每个请求开始阶段耗时追踪"""
+    g.trace, g.trace_token = start_trace(f"{request.method} {request.path}")
+
+def write_trace_record(trace, status_code):
+    """将请求的阶段耗时写入追踪日志"""
+    record = trace.to_record()
+    record["status"] = status_code
+    trace_logger.info(json.dumps(record, ensure_ascii=False))
+
 # 身份验证中间件
 def auth_middleware():
     """身份验证中间件，用于保护敏感接口"""
     # 允许访问首页、健康检查接口、必要的静态资源和生成的音频文件
-    if request.path in ['/','/api/voice_list', '/api/voice_sample', '/favicon.ico'] or request.path.startswith('/static/audio/'):
+    if request.path in ['/', '/api/health', '/api/ready', '/api/voice_list', '/api/voice_sample', '/favicon.ico'] or request.path.startswith('/static/audio/'):
         return
     
     # IP白名单验证
@@ -85,18 +310,62 @@ def auth_middleware():
         logger.warning(f"API密钥错误: {request.remote_addr} 使用无效密钥访问 {request.path}")
         abort(401, description="API密钥错误")
 
+# 准入控制中间件
+def admission_middleware():
+    """服务过载时尽早拒绝新的合成请求，按优先级从低到高依次拒绝"""
+    priority = ADMISSION_ROUTES.get(request.path)
+    if priority is None:
+        return
+    admitted, retry_after = admission.admit(priority)
+    if not admitted:
+        g.retry_after = retry_after
+        abort(503, description="服务繁忙，请稍后重试")
+
 # 静态文件路由 - 允许访问output目录中的音频文件
 @app.route('/static/audio/<filename>')
 def serve_audio(filename):
-    """提供音频文件的静态访问"""
+    """提供音频文件的静态访问，非本地存储时重定向到存储服务"""
+    if audio_storage.local_path(filename) is None:
+        if not audio_storage.exists(filename):
+            abort(404)
+        return redirect(audio_storage.get_url(filename))
     try:
-        return send_from_directory(app.config['UPLOAD_FOLDER'], filename, mimetype='audio/mpeg')
+        response = send_from_directory(app.config['UPLOAD_FOLDER'], filename, mimetype='audio/mpeg')
+        if TRACE_LOG_ENABLED:
+            # 传输结束时写入追踪记录
+            enable_close_callbacks(response)
+        return response
     except FileNotFoundError:
         abort(404)
 
 # 注册中间件
 app.before_request(log_request_middleware)
+app.before_request(trace_request_middleware)
 app.before_request(auth_middleware)
+app.before_request(admission_middleware)
+
+@app.after_request
+def add_server_timing(response):
+    """通过Server-Timing响应头返回阶段耗时，流式响应只包含开始传输前的阶段"""
+    trace = g.get('trace')
+    if trace is None:
+        return response
+    response.headers['Server-Timing'] = trace.server_timing()
+    if TRACE_LOG_ENABLED:
+        status_code = response.status_code
+        if response.is_streamed:
+            # 流式响应在传输结束后再写入完整记录
+            response.call_on_close(lambda: write_trace_record(trace, status_code))
+        else:
+            write_trace_record(trace, status_code)
+    return response
+
+@app.teardown_request
+def end_request_trace(error=None):
+    """结束请求追踪"""
+    token = g.pop('trace_token', None)
+    if token is not None:
+        end_trace(token)
 
 # 错误处理
 @app.errorhandler(401)
@@ -135,6 +404,19 @@ def method_not_allowed(error):
         "message": "不允许的请求方法"
     }), 405
 
+@app.errorhandler(503)
+def service_unavailable(error):
+    logger.warning(f"503错误: {error.description}")
+    response = jsonify({
+        "success": False,
+        "error": "Service Unavailable",
+        "message": error.description
+    })
+    retry_after = g.get('retry_after')
+    if retry_after:
+        response.headers['Retry-After'] = str(retry_after)
+    return response, 503
+
 @app.errorhandler(500)
 def internal_server_error(error):
     logger.error(f"500错误: {str(error)}")
@@ -152,6 +434,36 @@ def voice_demo():
     return render_template('voice_demo.html')
 
 
+@app.route('/api/health', methods=['GET'])
+def health_check():
+    """存活检查接口，进程能处理请求即返回200
+    
+    返回:
+        JSON: 服务状态
+    """
+    return jsonify({
+        "status": "ok",
+        "message": "服务正常运行"
+    })
+
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    """就绪检查接口，供负载均衡器判断是否继续分配流量
+    
+    返回:
+        JSON: 准入状态、负载水位、各容量信号及正在拒绝的请求类别；
+        交互式请求也被拒绝（满载）时返回503
+    """
+    status = admission.get_status()
+    response = jsonify({
+        "success": status["ready"],
+        "admission": status
+    })
+    if not status["ready"]:
+        response.headers['Retry-After'] = str(status["retry_after"])
+        return response, 503
+    return response
+
 @app.route('/api/voices', methods=['GET'])
 def get_voices():
     """获取可用语音列表接口
@@ -225,8 +537,19 @@ def generate_tts():
                 "available_voices": tts_service.list_available_voices()
             }), 400
         
-        # 生成语音
-        result = tts_service.generate_speech_sync(text, voice, rate)
+        # 文本预处理，在调用上游前拒绝无法合成的文本
+        try:
+            text = tts_service.preprocess_text(text, voice)
+        except TextValidationError as e:
+            logger.warning(f"语音生成请求文本无效: {str(e)}")
+            return jsonify({
+                "success": False,
+                "message": str(e)
+            }), 400
+        
+        # 生成语音（交互式优先级）
+        with scheduler.slot(PRIORITY_INTERACTIVE, get_client_id()):
+            result = tts_service.generate_speech_sync(text, voice, rate, normalized=True)
         
         if result['success']:
             # 检查是否需要直接返回文件 - 同时支持从查询参数和请求体中获取
@@ -235,7 +558,7 @@ def generate_tts():
             
             if return_json:
                 # 返回JSON结果，包含可访问的文件URL
-                file_url = f"{request.host_url}static/audio/{result['file_name']}"
+                file_url = build_file_url(result['file_name'], request.host_url)
                 return jsonify({
                     "success": True,
                     "message": "语音生成成功",
@@ -247,18 +570,19 @@ def generate_tts():
                 })
             else:
                 # 直接返回语音文件
-                return send_file(
-                    result['file_path'],
-                    mimetype='audio/mpeg',
-                    as_attachment=True,
-                    download_name=result['file_name']
-                )
+                return send_audio(result['file_name'], as_attachment=True)
         else:
             logger.error(f"语音生成失败: {result['message']}")
             return jsonify({
                 "success": False,
                 "message": result['message']
             }), 500
+    except SchedulerTimeoutError as e:
+        logger.warning(f"语音生成请求排队超时: {str(e)}")
+        return jsonify({
+            "success": False,
+            "message": f"服务繁忙，请稍后重试: {str(e)}"
+        }), 503
     except Exception as e:
         logger.error(f"处理语音生成请求时发生错误: {str(e)}")
         return jsonify({
@@ -315,18 +639,53 @@ def generate_tts_stream():
                 "available_voices": tts_service.list_available_voices()
             }), 400
         
+        # 文本预处理，在调用上游前拒绝无法合成的文本
+        try:
+            text = tts_service.preprocess_text(text, voice)
+        except TextValidationError as e:
+            logger.warning(f"流式语音生成请求文本无效: {str(e)}")
+            return jsonify({
+                "success": False,
+                "message": str(e)
+            }), 400
+        
+        # 返回响应前申请交互式合成槽位并取得首个音频数据块，
+        # 排队超时返回503，首块之前的失败返回500，而不是返回空的200响应
+        scheduler.acquire(PRIORITY_INTERACTIVE, get_client_id())
+        chunks = async_gen_to_sync(tts_service.generate_speech_stream(text, voice, rate, normalized=True))
+        try:
+            first_chunk = next(chunks, b"")
+        except Exception:
+            scheduler.release(PRIORITY_INTERACTIVE)
+            raise
+        
         # 定义流式响应生成器函数
-        @async_to_sync
-        async def audio_stream():
+        trace = current_trace()
+        def audio_stream():
             try:
-                async for chunk in tts_service.generate_speech_stream(text, voice, rate):
-                    yield chunk
+                with use_trace(trace):
+                    yield first_chunk
+                    for chunk in chunks:
+                        yield chunk
             except Exception as e:
                 logger.error(f"流式语音响应错误: {str(e)}")
         
+        def close_stream():
+            # 传输结束或客户端断开后关闭上游连接并释放槽位
+            chunks.close()
+            scheduler.release(PRIORITY_INTERACTIVE)
+        
         # 返回流式响应
         logger.info(f"开始流式语音传输: 语音模型={voice}")
-        return Response(audio_stream(), mimetype='audio/mpeg')
+        response = Response(audio_stream(), mimetype='audio/mpeg')
+        response.call_on_close(close_stream)
+        return response
+    except SchedulerTimeoutError as e:
+        logger.warning(f"流式语音生成请求排队超时: {str(e)}")
+        return jsonify({
+            "success": False,
+            "message": f"服务繁忙，请稍后重试: {str(e)}"
+        }), 503
     except Exception as e:
         logger.error(f"处理流式语音生成请求时发生错误: {str(e)}")
         return jsonify({
@@ -335,6 +694,76 @@ def generate_tts_stream():
         }), 500
 
 
+if SOCK_INSTALLED:
+    @sock.route('/api/tts/ws')
+    def tts_websocket(ws):
+        """增量文本合成WebSocket接口
+        
+        查询参数:
+            voice (str): 语音模型（可选，默认为zh-CN-YunxiNeural）
+            rate (str): 语速（可选，默认为+0%）
+        
+        客户端消息:
+            纯文本，或JSON对象 {"type": "text", "text": "..."} 追加文本；
+            {"type": "flush"} 将缓冲区中剩余文本作为一个句子立即合成；
+            {"type": "end"} 结束输入，等待所有音频发送完毕后关闭连接
+        
+        服务端消息:
+            每检测到一个完整句子就开始合成，按句子顺序发送
+            sentence_start 文本帧、音频二进制帧、sentence_end 文本帧，
+            全部完成后发送 {"type": "done"}
+        """
+        voice = request.args.get('voice', 'zh-CN-YunxiNeural')
+        rate = request.args.get('rate', '+0%')
+        logger.info(f"增量语音合成连接: 语音模型={voice}, 语速={rate}")
+        
+        # 验证语音模型
+        if not tts_service.validate_voice(voice):
+            logger.warning(f"增量语音合成请求: 不支持的语音模型: {voice}")
+            ws.send(json.dumps({"type": "error", "message": f"不支持的语音模型: {voice}"}, ensure_ascii=False))
+            return
+        
+        segmenter = SentenceSegmenter()
+        synthesizer = IncrementalSynthesizer(
+            tts_service, voice, rate, ws.send,
+            scheduler=scheduler,
+            api_key=get_client_id(),
+            prefetch=INCREMENTAL_PREFETCH
+        )
+        try:
+            while True:
+                message = ws.receive()
+                if message is None:
+                    continue
+                if isinstance(message, bytes):
+                    message = message.decode('utf-8')
+                
+                # 以"{"开头的消息按JSON控制消息解析，其余作为纯文本
+                command = {"type": "text", "text": message}
+                if message.lstrip().startswith('{'):
+                    try:
+                        command = json.loads(message)
+                    except ValueError:
+                        pass
+                
+                message_type = command.get('type', 'text')
+                sentences = segmenter.feed(command.get('text', ''))
+                if message_type in ('flush', 'end'):
+                    sentences += segmenter.flush()
+                for sentence in sentences:
+                    synthesizer.submit(sentence)
+                
+                if message_type == 'end':
+                    synthesizer.finish()
+                    ws.send(json.dumps({"type": "done", "sentences": synthesizer.submitted}))
+                    logger.info(f"增量语音合成完成，共 {synthesizer.submitted} 个句子")
+                    break
+        except Exception as e:
+            logger.info(f"增量语音合成连接结束: {str(e)}")
+        finally:
+            synthesizer.close()
+
+
 @app.route('/api/voice_list')
 def get_voice_list():
     """获取语音列表接口
@@ -400,24 +829,63 @@ def get_voice_sample():
         
         logger.info(f"生成语音样本请求: 语音模型={voice}")
         
-        # 使用tts_service生成语音样本
-        result = tts_service.generate_speech_sync(sample_text, voice)
+        # 使用tts_service生成语音样本（最低优先级）
+        with scheduler.slot(PRIORITY_SAMPLE, get_client_id()):
+            result = tts_service.generate_speech_sync(sample_text, voice)
         
         if result['success']:
             logger.info(f"语音样本生成成功: {result['file_name']}")
             # 直接返回语音文件
-            return send_file(
-                result['file_path'],
-                mimetype='audio/mpeg',
-                as_attachment=False
-            )
+            return send_audio(result['file_name'])
         else:
             logger.error(f"语音样本生成失败: {result['message']}")
             abort(500, description=f"生成语音样本失败: {result['message']}")
+    except SchedulerTimeoutError as e:
+        logger.warning(f"语音样本请求排队超时: {str(e)}")
+        abort(503, description=f"服务繁忙，请稍后重试: {str(e)}")
     except Exception as e:
         logger.error(f"处理语音样本请求时发生错误: {str(e)}")
         abort(500, description=f"处理请求时发生错误: {str(e)}")
 
+def render_batch_job(text, voice, rate, api_key, host_url):
+    """执行一个去重后的批量合成任务
+    
+    返回:
+        dict: 批量接口格式的结果，包含code、data和msg字段
+    """
+    try:
+        # 批量优先级，逐个任务申请槽位以便交互式请求插队；文本已在去重时预处理
+        with scheduler.slot(PRIORITY_BATCH, api_key):
+            result = tts_service.generate_speech_sync(text, voice, rate, normalized=True)
+        
+        if result['success']:
+            # 生成文件URL
+            file_url = build_file_url(result['file_name'], host_url)
+            return {
+                "code": 0,
+                "data": {
+                    "link": file_url
+                },
+                "msg": "success"
+            }
+        return {
+            "code": 500,
+            "data": None,
+            "msg": result['message']
+        }
+    except SchedulerTimeoutError as e:
+        return {
+            "code": 503,
+            "data": None,
+            "msg": f"服务繁忙，请稍后重试: {str(e)}"
+        }
+    except Exception as e:
+        return {
+            "code": 500,
+            "data": None,
+            "msg": f"处理请求时发生错误: {str(e)}"
+        }
+
 @app.route('/api/tts/batch', methods=['POST'])
 def generate_tts_batch():
     """批量生成语音接口
@@ -428,6 +896,10 @@ def generate_tts_batch():
             voice (str): 语音模型（可选，默认为zh-CN-YunxiNeural）
             rate (str): 语速（可选，默认为+0%）
     
+    查询参数:
+        stream (str): 设置为true时以NDJSON格式流式返回，每完成一个任务输出一行，
+            每行包含index字段标识任务在数组中的位置
+    
     返回:
         JSON: 包含所有生成任务结果的数组，每个结果包含link和msg字段
     """
@@ -444,21 +916,27 @@ def generate_tts_batch():
                 "msg": "请求参数必须是有效的数组"
             })
         
+        stream = request.args.get('stream', 'false').lower() == 'true'
+        api_key = get_client_id()
+        host_url = request.host_url
+        
         # 记录请求信息
-        logger.info(f"批量语音生成请求: 共 {len(data)} 个任务")
+        logger.info(f"批量语音生成请求: 共 {len(data)} 个任务, 流式返回={stream}")
         
-        # 处理每个语音生成任务
-        results = []
+        # 校验每个任务，并将相同的任务合并为一个合成任务
+        results = [None] * len(data)
+        jobs = {}  # 去重键 -> (文本, 语音模型, 语速, 使用该结果的任务下标列表)
+        voice_valid = {}  # 同一批次内每个语音模型只校验一次
         for i, task in enumerate(data):
             try:
                 # 验证任务必需参数
-                if not task or 'text' not in task:
+                if not isinstance(task, dict) or 'text' not in task:
                     logger.warning(f"批量任务 {i+1} 缺少必需参数: text")
-                    results.append({
+                    results[i] = {
                         "code": 400,
                         "data": None,
                         "msg": "缺少必需参数: text"
-                    })
+                    }
                     continue
                 
                 # 获取任务参数值，设置默认值
@@ -466,54 +944,100 @@ def generate_tts_batch():
                 voice = task.get('voice', 'zh-CN-YunxiNeural')
                 rate = task.get('rate', '+0%')
                 
+                # 参数必须是字符串，其他类型无法处理，也不能用作去重键
+                if not all(isinstance(value, str) for value in (text, voice, rate)):
+                    logger.warning(f"批量任务 {i+1} 参数类型错误")
+                    results[i] = {
+                        "code": 400,
+                        "data": None,
+                        "msg": "参数text、voice、rate必须是字符串"
+                    }
+                    continue
+                
                 # 验证文本长度
                 if len(text.strip()) == 0:
                     logger.warning(f"批量任务 {i+1} 文本为空")
-                    results.append({
+                    results[i] = {
                         "code": 400,
                         "data": None,
                         "msg": "文本不能为空"
-                    })
+                    }
                     continue
                 
                 # 验证语音模型
-                if not tts_service.validate_voice(voice):
+                if voice not in voice_valid:
+                    voice_valid[voice] = tts_service.validate_voice(voice)
+                if not voice_valid[voice]:
                     logger.warning(f"批量任务 {i+1} 不支持的语音模型: {voice}")
-                    results.append({
+                    results[i] = {
                         "code": 400,
                         "data": None,
                         "msg": f"不支持的语音模型: {voice}"
-                    })
+                    }
                     continue
                 
-                # 生成语音
-                result = tts_service.generate_speech_sync(text, voice, rate)
-                
-                if result['success']:
-                    logger.info(f"批量任务 {i+1} 语音生成成功: {result['file_name']}")
-                    # 生成文件URL
-                    file_url = f"{request.host_url}static/audio/{result['file_name']}"
-                    results.append({
-                        "code": 0,
-                        "data": {
-                            "link": file_url
-                        },
-                        "msg": "success"
-                    })
-                else:
-                    logger.error(f"批量任务 {i+1} 语音生成失败: {result['message']}")
-                    results.append({
-                        "code": 500,
+                # 按规范化后的文本去重，相同（规范化文本、语音模型、语速）的任务只合成一次
+                try:
+                    key = tts_service.canonical_key(text, voice, rate)
+                except TextValidationError as e:
+                    logger.warning(f"批量任务 {i+1} 文本无效: {str(e)}")
+                    results[i] = {
+                        "code": 400,
                         "data": None,
-                        "msg": result['message']
-                    })
+                        "msg": str(e)
+                    }
+                    continue
+                job = jobs.setdefault(key, (key[0], voice, rate, []))
+                job[3].append(i)
             except Exception as e:
                 logger.error(f"处理批量任务 {i+1} 时发生错误: {str(e)}")
-                results.append({
+                results[i] = {
                     "code": 500,
                     "data": None,
                     "msg": f"处理请求时发生错误: {str(e)}"
-                })
+                }
+        
+        logger.info(f"批量语音生成去重后共 {len(jobs)} 个合成任务")
+        
+        def run_jobs():
+            """并发执行合成任务，每完成一个任务产出 (任务下标列表, 结果)"""
+            executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS)
+            try:
+                # 每个任务复制当前上下文，使工作线程中的阶段耗时计入本请求的追踪
+                futures = {
+                    executor.submit(contextvars.copy_context().run, render_batch_job,
+                                    text, voice, rate, api_key, host_url): indices
+                    for text, voice, rate, indices in jobs.values()
+                }
+                for future in as_completed(futures):
+                    indices = futures[future]
+                    result = future.result()
+                    if result['code'] == 0:
+                        logger.info(f"批量任务 {', '.join(str(i+1) for i in indices)} 语音生成成功")
+                    else:
+                        logger.error(f"批量任务 {', '.join(str(i+1) for i in indices)} 语音生成失败: {result['msg']}")
+                    yield indices, result
+            finally:
+                # 客户端提前断开时取消尚未开始的任务
+                executor.shutdown(wait=False, cancel_futures=True)
+        
+        if stream:
+            trace = current_trace()
+            def ndjson_stream():
+                # 先输出校验失败的任务，再按完成顺序输出合成结果
+                for i, result in enumerate(results):
+                    if result is not None:
+                        yield json.dumps({"index": i, **result}, ensure_ascii=False) + "\n"
+                with use_trace(trace):
+                    for indices, result in run_jobs():
+                        for i in indices:
+                            yield json.dumps({"index": i, **result}, ensure_ascii=False) + "\n"
+            
+            return Response(ndjson_stream(), mimetype='application/x-ndjson')
+        
+        for indices, result in run_jobs():
+            for i in indices:
+                results[i] = result
         
         # 返回所有任务的结果
         return jsonify(results)
@@ -525,6 +1049,99 @@ def generate_tts_batch():
             "msg": f"处理请求时发生错误: {str(e)}"
         })
 
+@app.route('/api/scheduler/stats', methods=['GET'])
+def get_scheduler_stats():
+    """获取调度器统计信息接口
+    
+    返回:
+        JSON: 当前并发数及每个优先级类别的队列深度和等待时间
+    """
+    return jsonify({
+        "success": True,
+        "scheduler": scheduler.get_stats()
+    })
+
+@app.route('/api/hedge/stats', methods=['GET'])
+def get_hedge_stats():
+    """获取上游对冲请求统计信息接口
+    
+    返回:
+        JSON: 当前对冲阈值、预算及对冲发起/胜出次数
+    """
+    return jsonify({
+        "success": True,
+        "hedge": tts_service.hedge_policy.get_stats()
+    })
+
+@app.route('/api/engines/stats', methods=['GET'])
+def get_engine_stats():
+    """获取合成引擎路由统计信息接口
+    
+    返回:
+        JSON: 主引擎/降级引擎、是否处于降级状态、最近错误率及各引擎处理的请求数
+    """
+    return jsonify({
+        "success": True,
+        "engines": engine_router.get_stats()
+    })
+
+
+@app.route('/api/admin/profile', methods=['GET'])
+def run_profiler():
+    """按需采样分析接口，在当前工作进程中采样指定时长并返回聚合后的调用栈
+    
+    请求头:
+        X-API-Key (str): API密钥（必需）
+        X-Admin-Key (str): 管理员密钥（必需）
+    
+    查询参数:
+        seconds (float): 采样时长（秒），默认5，最长60
+        interval_ms (float): 采样间隔（毫秒），默认5，最小1，不超过采样时长
+        limit (int): 返回的调用栈数量，默认50
+        format (str): json（默认）或collapsed（可直接用于生成火焰图）
+    
+    返回:
+        JSON或文本: 聚合后的调用栈及采样次数
+    """
+    if not ADMIN_API_KEY:
+        abort(403, description="未配置管理员密钥，管理接口已禁用")
+    if request.headers.get("X-Admin-Key") != ADMIN_API_KEY:
+        logger.warning(f"管理员密钥错误: {request.remote_addr} 访问 {request.path}")
+        abort(403, description="管理员密钥错误")
+    
+    try:
+        seconds = float(request.args.get('seconds', 5))
+        interval = float(request.args.get('interval_ms', 5)) / 1000
+        limit = int(request.args.get('limit', 50))
+        if not (math.isfinite(seconds) and math.isfinite(interval)):
+            raise ValueError("参数必须是有限数值")
+    except ValueError:
+        return jsonify({
+            "success": False,
+            "message": "参数格式错误"
+        }), 400
+    
+    logger.info(f"开始采样分析: 时长={seconds}秒, 间隔={interval * 1000}毫秒")
+    try:
+        profile = profiler.run(seconds, interval)
+    except ProfilerBusyError as e:
+        return jsonify({
+            "success": False,
+            "message": str(e)
+        }), 409
+    
+    top_stacks = profile['stacks'].most_common(limit)
+    if request.args.get('format') == 'collapsed':
+        body = "\n".join(f"{stack} {count}" for stack, count in top_stacks)
+        return Response(body + "\n", mimetype='text/plain')
+    return jsonify({
+        "success": True,
+        "samples": profile['samples'],
+        "duration": profile['duration'],
+        "interval": profile['interval'],
+        "stacks": [{"stack": stack.split(";"), "count": count} for stack, count in top_stacks]
+    })
+
 
 if __name__ == "__main__":
     # 在开发环境中运行Flask应用
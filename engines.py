@@ -0,0 +1,287 @@
+import re
+import time
+import shutil
+import asyncio
+import threading
+from collections import deque
+import edge_tts
+# 导入日志配置
+from logger_config import tts_logger
+
+
+class SynthesisEngine:
+    """语音合成引擎基类
+
+    stream 为异步生成器，逐块产出 audio/mpeg 音频数据。
+    """
+
+    name = "base"
+
+    def is_available(self):
+        """引擎在当前环境中是否可用"""
+        return True
+
+    async def stream(self, text, voice, rate):
+        """流式合成语音
+
+        参数:
+            text (str): 要转换为语音的文本
+            voice (str): 语音模型名称
+            rate (str): 语速，格式为"+/-数字%"
+
+        生成:
+            bytes: 语音数据块
+        """
+        raise NotImplementedError
+        yield
+
+    def list_voices(self):
+        """返回引擎支持的语音模型名称列表"""
+        return []
+
+
+class EdgeTTSEngine(SynthesisEngine):
+    """基于Edge-TTS的在线合成引擎"""
+
+    name = "edge-tts"
+
+    def __init__(self, voice_cache_ttl=3600):
+        """初始化Edge-TTS引擎
+
+        参数:
+            voice_cache_ttl (float): 语音列表缓存时间（秒），上游不可用时继续使用过期的缓存
+        """
+        self.voice_cache_ttl = voice_cache_ttl
+        self._voices = None
+        self._voices_fetched_at = 0.0
+        self._lock = threading.Lock()
+
+    async def stream(self, text, voice, rate):
+        communicate = edge_tts.Communicate(text, voice, rate=rate)
+        async for chunk in communicate.stream():
+            if chunk["type"] == "audio":
+                yield chunk["data"]
+
+    def list_voices(self):
+        with self._lock:
+            if self._voices is not None and time.monotonic() - self._voices_fetched_at < self.voice_cache_ttl:
+                return self._voices
+        try:
+            voices = asyncio.run(edge_tts.list_voices())
+        except Exception as e:
+            with self._lock:
+                if self._voices is None:
+                    raise
+                tts_logger.warning(f"刷新Edge-TTS语音列表失败，继续使用缓存: {str(e)}")
+                return self._voices
+        names = [voice['ShortName'] for voice in voices if 'ShortName' in voice]
+        with self._lock:
+            self._voices = names
+            self._voices_fetched_at = time.monotonic()
+        return names
+
+
+class EspeakEngine(SynthesisEngine):
+    """基于espeak-ng的本地离线合成引擎
+
+    音质不如在线引擎，但不依赖网络、延迟稳定，适合作为降级方案。
+    espeak-ng 输出WAV，再通过 ffmpeg 编码为MP3，保持与在线引擎相同的音频格式。
+    """
+
+    name = "espeak-ng"
+
+    # Edge-TTS语言区域到espeak-ng语音的映射，未列出的使用语言代码
+    VOICE_MAP = {
+        "zh-CN": "cmn",
+        "zh-TW": "cmn",
+        "zh-HK": "yue",
+        "wuu-CN": "cmn",
+        "yue-CN": "yue",
+        "en-US": "en-us",
+        "en-GB": "en-gb",
+        "pt-BR": "pt-br",
+        "es-MX": "es-419",
+    }
+    # espeak-ng 默认语速（每分钟单词数）
+    BASE_SPEED = 175
+
+    def __init__(self, espeak_path="espeak-ng", ffmpeg_path="ffmpeg"):
+        self.espeak_path = espeak_path
+        self.ffmpeg_path = ffmpeg_path
+
+    def is_available(self):
+        return shutil.which(self.espeak_path) is not None and shutil.which(self.ffmpeg_path) is not None
+
+    def _espeak_voice(self, voice):
+        """将Edge-TTS语音模型名称（如zh-CN-YunxiNeural）转换为espeak-ng语音"""
+        parts = voice.split("-")
+        locale = "-".join(parts[:2])
+        return self.VOICE_MAP.get(locale, parts[0].lower())
+
+    def _speed(self, rate):
+        """将"+/-数字%"格式的语速转换为espeak-ng的每分钟单词数"""
+        match = re.fullmatch(r"\s*([+-]?\d+)%\s*", rate or "")
+        percent = int(match.group(1)) if match else 0
+        return max(80, min(450, int(self.BASE_SPEED * (1 + percent / 100))))
+
+    async def stream(self, text, voice, rate):
+        # espeak-ng 从标准输入读取UTF-8文本，WAV输出到标准输出
+        espeak = await asyncio.create_subprocess_exec(
+            self.espeak_path, "-b", "1", "-v", self._espeak_voice(voice), "-s", str(self._speed(rate)), "--stdin", "--stdout",
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        try:
+            wav, stderr = await espeak.communicate(text.encode("utf-8"))
+        finally:
+            # 首块超时或客户端断开时任务会被取消，结束并回收子进程
+            if espeak.returncode is None:
+                espeak.kill()
+                await espeak.wait()
+        if espeak.returncode != 0:
+            raise RuntimeError(f"espeak-ng合成失败: {stderr.decode('utf-8', 'replace').strip()}")
+
+        ffmpeg = await asyncio.create_subprocess_exec(
+            self.ffmpeg_path, "-hide_banner", "-loglevel", "error", "-f", "wav", "-i", "pipe:0",
+            "-f", "mp3", "-codec:a", "libmp3lame", "-q:a", "4", "pipe:1",
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+
+        async def feed():
+            try:
+                ffmpeg.stdin.write(wav)
+                await ffmpeg.stdin.drain()
+            finally:
+                ffmpeg.stdin.close()
+
+        feeder = asyncio.ensure_future(feed())
+        try:
+            while True:
+                data = await ffmpeg.stdout.read(4096)
+                if not data:
+                    break
+                yield data
+            await feeder
+            if await ffmpeg.wait() != 0:
+                raise RuntimeError("ffmpeg编码MP3失败")
+        finally:
+            if ffmpeg.returncode is None:
+                ffmpeg.kill()
+                await ffmpeg.wait()
+            feeder.cancel()
+
+
+class EngineRouter:
+    """合成引擎路由
+
+    默认使用主引擎；以下情况路由到降级引擎：
+    - 语音模型被标记为仅离线（offline_voices）
+    - 主引擎最近的错误率或首块延迟p95超过阈值，此后 cooldown 秒内都使用降级引擎，
+      冷却结束后重新尝试主引擎
+    """
+
+    def __init__(self, primary, fallback=None, offline_voices=(), error_rate_threshold=0.5,
+                 latency_threshold=5.0, cooldown=30.0, window_size=50, min_samples=10):
+        """初始化引擎路由
+
+        参数:
+            primary (SynthesisEngine): 主引擎
+            fallback (SynthesisEngine): 降级引擎，None表示不降级
+            offline_voices (iterable): 始终使用降级引擎的语音模型
+            error_rate_threshold (float): 触发降级的错误率
+            latency_threshold (float): 触发降级的首块延迟p95（秒）
+            cooldown (float): 降级持续时间（秒）
+            window_size (int): 统计使用的最近请求数
+            min_samples (int): 判断是否降级所需的最少样本数
+        """
+        self.primary = primary
+        self.fallback = fallback if fallback is not None and fallback.is_available() else None
+        if fallback is not None and self.fallback is None:
+            tts_logger.warning(f"降级引擎 {fallback.name} 在当前环境中不可用，已禁用降级")
+        self.offline_voices = set(offline_voices)
+        self.error_rate_threshold = error_rate_threshold
+        self.latency_threshold = latency_threshold
+        self.cooldown = cooldown
+        self.min_samples = min_samples
+        self._outcomes = deque(maxlen=window_size)
+        # 带时间戳的主引擎成功请求首块延迟，供准入控制按时间窗口读取
+        self._latencies = deque(maxlen=window_size)
+        self._degraded_until = 0.0
+        self._lock = threading.Lock()
+        self.routed = {primary.name: 0}
+        if self.fallback is not None:
+            self.routed[self.fallback.name] = 0
+        self.failovers = 0
+
+    def is_offline_voice(self, voice):
+        """语音模型是否只能由降级引擎合成"""
+        return self.fallback is not None and voice in self.offline_voices
+
+    def is_degraded(self):
+        """主引擎当前是否处于降级状态"""
+        return self.fallback is not None and time.monotonic() < self._degraded_until
+
+    def select(self, voice):
+        """为一个请求选择合成引擎"""
+        engine = self.fallback if self.is_offline_voice(voice) or self.is_degraded() else self.primary
+        with self._lock:
+            self.routed[engine.name] += 1
+        return engine
+
+    def fallback_for(self, engine):
+        """主引擎请求失败时可用的降级引擎，没有时返回None"""
+        if engine is self.primary and self.fallback is not None:
+            with self._lock:
+                self.failovers += 1
+            return self.fallback
+        return None
+
+    def record(self, engine, latency, success):
+        """记录主引擎请求的首块延迟和结果，必要时切换到降级状态"""
+        if engine is not self.primary:
+            return
+        with self._lock:
+            if success:
+                self._latencies.append((time.monotonic(), latency))
+            if self.fallback is None:
+                return
+            self._outcomes.append((latency, success))
+            if len(self._outcomes) < self.min_samples:
+                return
+            errors = sum(1 for _, ok in self._outcomes if not ok)
+            error_rate = errors / len(self._outcomes)
+            latencies = sorted(latency for latency, _ in self._outcomes)
+            p95 = latencies[int(len(latencies) * 0.95)]
+            if error_rate >= self.error_rate_threshold or p95 >= self.latency_threshold:
+                self._degraded_until = time.monotonic() + self.cooldown
+                # 清空样本，冷却结束后根据新的请求重新判断
+                self._outcomes.clear()
+                tts_logger.warning(
+                    f"主引擎 {self.primary.name} 降级 {self.cooldown} 秒: 错误率={error_rate:.2f}, 首块延迟p95={p95:.3f}秒")
+
+    def recent_latency(self, window=30.0, percentile=0.95, min_samples=None):
+        """主引擎最近 window 秒内成功请求首块延迟的分位数（秒），样本数不足 min_samples 时返回0"""
+        if min_samples is None:
+            min_samples = self.min_samples
+        cutoff = time.monotonic() - window
+        with self._lock:
+            latencies = sorted(latency for at, latency in self._latencies if at >= cutoff)
+        if not latencies or len(latencies) < min_samples:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile))]
+
+    def get_stats(self):
+        """获取路由统计信息"""
+        with self._lock:
+            outcomes = list(self._outcomes)
+            routed = dict(self.routed)
+            failovers = self.failovers
+        errors = sum(1 for _, ok in outcomes if not ok)
+        return {
+            "primary": self.primary.name,
+            "fallback": self.fallback.name if self.fallback else None,
+            "degraded": self.is_degraded(),
+            "degraded_remaining": round(max(0.0, self._degraded_until - time.monotonic()), 1),
+            "recent_error_rate": round(errors / len(outcomes), 3) if outcomes else 0.0,
+            "recent_samples": len(outcomes),
+            "offline_voices": sorted(self.offline_voices),
+            "routed": routed,
+            "failovers": failovers,
+        }
@@ -0,0 +1,102 @@
+import threading
+from collections import deque
+
+
+class HedgePolicy:
+    """上游对冲请求策略
+
+    当上游在阈值时间内仍未返回首个音频数据块时，允许发起第二个相同的上游会话。
+    阈值可以是固定值，也可以根据最近观测到的首块延迟分位数（默认p95）动态计算；
+    对冲次数受令牌桶预算限制：每个请求补充 budget_ratio 个令牌，每次对冲消耗一个，
+    因此额外的上游负载不会超过请求量的 budget_ratio 倍（外加 burst 个突发额度）。
+    """
+
+    def __init__(self, enabled=False, delay=None, percentile=0.95, default_delay=1.0,
+                 min_delay=0.2, budget_ratio=0.1, burst=5, window_size=200, min_samples=20):
+        """初始化对冲策略
+
+        参数:
+            enabled (bool): 是否启用对冲
+            delay (float): 固定对冲阈值（秒），None表示根据观测延迟动态计算
+            percentile (float): 动态阈值使用的分位数
+            default_delay (float): 样本不足时使用的阈值（秒）
+            min_delay (float): 动态阈值的下限（秒）
+            budget_ratio (float): 对冲请求占总请求的最大比例
+            burst (int): 令牌桶容量，允许的突发对冲数量
+            window_size (int): 保留的最近首块延迟样本数
+            min_samples (int): 计算动态阈值所需的最少样本数
+        """
+        self.enabled = enabled
+        self.delay = delay
+        self.percentile = percentile
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.budget_ratio = budget_ratio
+        self.burst = burst
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window_size)
+        self._tokens = float(burst)
+        self._lock = threading.Lock()
+        # 计数器
+        self.requests = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+        self.hedges_denied = 0
+
+    def get_delay(self):
+        """获取当前的对冲阈值（秒）"""
+        if self.delay is not None:
+            return self.delay
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return self.default_delay
+            samples = sorted(self._latencies)
+        value = samples[min(len(samples) - 1, int(len(samples) * self.percentile))]
+        return max(self.min_delay, value)
+
+    def on_request(self):
+        """记录一个新的上游请求，并补充对冲预算"""
+        with self._lock:
+            self.requests += 1
+            self._tokens = min(float(self.burst), self._tokens + self.budget_ratio)
+
+    def try_hedge(self):
+        """尝试消耗一次对冲预算
+
+        返回:
+            bool: 是否允许发起对冲请求
+        """
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                self.hedges_fired += 1
+                return True
+            self.hedges_denied += 1
+            return False
+
+    def record_first_chunk(self, latency, hedged_won=False):
+        """记录从请求开始到收到首个音频数据块的耗时
+
+        参数:
+            latency (float): 首块延迟（秒）
+            hedged_won (bool): 是否由对冲请求先返回音频
+        """
+        with self._lock:
+            self._latencies.append(latency)
+            if hedged_won:
+                self.hedges_won += 1
+
+    def get_stats(self):
+        """获取对冲统计信息"""
+        delay = self.get_delay()
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "delay_ms": round(delay * 1000, 1),
+                "delay_mode": "fixed" if self.delay is not None else f"p{int(self.percentile * 100)}",
+                "requests": self.requests,
+                "hedges_fired": self.hedges_fired,
+                "hedges_won": self.hedges_won,
+                "hedges_denied": self.hedges_denied,
+                "budget_tokens": round(self._tokens, 2),
+            }
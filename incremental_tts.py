@@ -0,0 +1,236 @@
+import json
+import asyncio
+import threading
+# 导入日志配置
+from logger_config import tts_logger
+from scheduler import PRIORITY_INTERACTIVE
+
+# 句子结束标点：中文标点无需后续字符即可确认，英文标点需后跟空白才算结束（避免切开3.14、e.g.等）
+CJK_TERMINATORS = "。！？；…\n"
+ASCII_TERMINATORS = ".!?;"
+# 可以跟在句末标点后面的闭合符号
+CLOSING_MARKS = "\"'”’」』）)]】》"
+# 句子过长时优先在这些位置切分
+SOFT_BREAKS = "，,、：:　 "
+
+# 标记一个句子的音频数据已经结束
+_END = object()
+
+
+class SentenceSegmenter:
+    """增量句子切分器
+
+    逐段接收文本（例如LLM逐个输出的token），在检测到完整句子时立即返回，
+    未结束的部分保留在缓冲区中等待后续文本。
+    """
+
+    def __init__(self, max_length=200):
+        """初始化切分器
+
+        参数:
+            max_length (int): 单个句子的最大长度，超过后在软断点处强制切分
+        """
+        self.max_length = max_length
+        self._buffer = ""
+
+    def _find_boundary(self):
+        """在缓冲区中查找第一个句子边界，返回句子结束位置，找不到时返回-1"""
+        buffer = self._buffer
+        for i, char in enumerate(buffer):
+            if char in CJK_TERMINATORS:
+                end = i + 1
+            elif char in ASCII_TERMINATORS:
+                # 英文标点需要看到后续字符才能确认是否为句子结束
+                j = i + 1
+                while j < len(buffer) and buffer[j] in CLOSING_MARKS:
+                    j += 1
+                if j >= len(buffer) or not buffer[j].isspace():
+                    continue
+                # 单词内部已有"."时视为缩写（如e.g.、U.S.），不作为句子结束
+                word_start = max(buffer.rfind(" ", 0, i), buffer.rfind("\n", 0, i)) + 1
+                if char == "." and "." in buffer[word_start:i]:
+                    continue
+                end = i + 1
+            else:
+                continue
+            # 把紧跟的闭合符号和重复标点（如"？！"、"……"）归入当前句子
+            while end < len(buffer) and (buffer[end] in CLOSING_MARKS or buffer[end] in CJK_TERMINATORS):
+                end += 1
+            return end
+        if len(buffer) >= self.max_length:
+            # 过长且没有句末标点时，在最后一个软断点处切分，没有软断点则直接截断
+            window = buffer[:self.max_length]
+            cut = max(window.rfind(mark) for mark in SOFT_BREAKS)
+            return cut + 1 if cut > 0 else self.max_length
+        return -1
+
+    def feed(self, text):
+        """追加文本并返回新完成的句子
+
+        参数:
+            text (str): 新到达的文本片段
+
+        返回:
+            list: 已完成的句子列表
+        """
+        self._buffer += text
+        sentences = []
+        while True:
+            end = self._find_boundary()
+            if end < 0:
+                break
+            sentence, self._buffer = self._buffer[:end].strip(), self._buffer[end:]
+            # 只有标点的片段无法朗读，直接丢弃
+            if any(c.isalnum() for c in sentence):
+                sentences.append(sentence)
+        return sentences
+
+    def flush(self):
+        """返回缓冲区中剩余的文本（作为最后一个句子）并清空缓冲区"""
+        sentence, self._buffer = self._buffer.strip(), ""
+        return [sentence] if any(c.isalnum() for c in sentence) else []
+
+
+class IncrementalSynthesizer:
+    """增量语音合成器
+
+    每提交一个句子就立即开始合成（同时最多 prefetch 个句子），
+    音频数据按句子提交顺序通过 send 回调发送给客户端。
+    内部在独立线程中运行事件循环，submit/finish/close 可以在任意线程调用。
+
+    发送的消息:
+        文本帧 {"type": "sentence_start", "index": i, "text": "..."}
+        二进制帧 该句子的音频数据（audio/mpeg）
+        文本帧 {"type": "error", "index": i, "message": "..."}（合成失败时）
+        文本帧 {"type": "sentence_end", "index": i}
+    """
+
+    def __init__(self, tts_service, voice, rate, send, scheduler=None, api_key=None, prefetch=2):
+        """初始化增量合成器
+
+        参数:
+            tts_service (TTSService): TTS服务
+            voice (str): 语音模型名称
+            rate (str): 语速
+            send (callable): 发送消息的回调，接收str（控制消息）或bytes（音频数据）
+            scheduler (RequestScheduler): 合成请求调度器，每个句子占用一个交互式槽位
+            api_key (str): 调度时使用的API密钥
+            prefetch (int): 同时合成的最大句子数
+        """
+        self.tts_service = tts_service
+        self.voice = voice
+        self.rate = rate
+        self.send = send
+        self.scheduler = scheduler
+        self.api_key = api_key
+        self.prefetch = prefetch
+        self._count = 0
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="incremental-tts", daemon=True)
+        self._thread.start()
+        self._tasks = set()
+        # 事件循环内的对象需要在事件循环线程中创建
+        self._order, self._slots = asyncio.run_coroutine_threadsafe(self._setup(), self._loop).result()
+        self._sender = asyncio.run_coroutine_threadsafe(self._send_in_order(), self._loop)
+
+    async def _setup(self):
+        return asyncio.Queue(), asyncio.Semaphore(self.prefetch)
+
+    async def _acquire_slot(self):
+        """在线程池中申请调度槽位，避免阻塞事件循环"""
+        future = self._loop.run_in_executor(None, self.scheduler.acquire, PRIORITY_INTERACTIVE, self.api_key)
+        try:
+            await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # 连接已关闭但槽位仍可能在稍后获得，获得后立即释放
+            future.add_done_callback(
+                lambda f: f.exception() is None and self.scheduler.release(PRIORITY_INTERACTIVE))
+            raise
+
+    async def _synthesize(self, index, sentence, chunks):
+        """合成一个句子，将音频数据放入该句子的队列"""
+        async with self._slots:
+            acquired = False
+            try:
+                if self.scheduler is not None:
+                    await self._acquire_slot()
+                    acquired = True
+                async for data in self.tts_service.generate_speech_stream(sentence, self.voice, self.rate):
+                    await chunks.put(data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                tts_logger.error(f"增量语音合成失败: 句子={index}, 错误={str(e)}")
+                await chunks.put(e)
+            finally:
+                if acquired:
+                    self.scheduler.release(PRIORITY_INTERACTIVE)
+                chunks.put_nowait(_END)
+
+    async def _send(self, message):
+        await self._loop.run_in_executor(None, self.send, message)
+
+    async def _send_in_order(self):
+        """按提交顺序发送每个句子的音频数据"""
+        while True:
+            item = await self._order.get()
+            if item is None:
+                return
+            index, sentence, chunks = item
+            await self._send(json.dumps({"type": "sentence_start", "index": index, "text": sentence}, ensure_ascii=False))
+            while True:
+                data = await chunks.get()
+                if data is _END:
+                    break
+                if isinstance(data, Exception):
+                    await self._send(json.dumps({"type": "error", "index": index, "message": str(data)}, ensure_ascii=False))
+                    continue
+                await self._send(data)
+            await self._send(json.dumps({"type": "sentence_end", "index": index}))
+
+    def _enqueue(self, index, sentence):
+        chunks = asyncio.Queue()
+        task = self._loop.create_task(self._synthesize(index, sentence, chunks))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self._order.put_nowait((index, sentence, chunks))
+
+    @property
+    def submitted(self):
+        """已提交的句子数"""
+        return self._count
+
+    def submit(self, sentence):
+        """提交一个完整的句子并立即开始合成
+
+        返回:
+            int: 句子序号
+        """
+        index = self._count
+        self._count += 1
+        self._loop.call_soon_threadsafe(self._enqueue, index, sentence)
+        return index
+
+    def finish(self, timeout=None):
+        """等待所有已提交句子的音频发送完毕"""
+        self._loop.call_soon_threadsafe(self._order.put_nowait, None)
+        self._sender.result(timeout)
+
+    def close(self):
+        """取消未完成的合成并停止事件循环"""
+        if not self._loop.is_running():
+            return
+
+        async def shutdown():
+            self._sender.cancel()
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        try:
+            asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result(5)
+        except Exception as e:
+            tts_logger.warning(f"关闭增量语音合成器时出错: {str(e)}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+        self._loop.close()
@@ -80,4 +80,7 @@ logger = setup_logger()
 access_logger = setup_logger('access', logging.INFO)
 
 # TTS服务日志记录器
-tts_logger = setup_logger('tts', logging.INFO)
\ No newline at end of file
+tts_logger = setup_logger('tts', logging.INFO)
+
+# 请求追踪日志记录器
+trace_logger = setup_logger('trace', logging.INFO)
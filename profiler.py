@@ -0,0 +1,82 @@
+import os
+import sys
+import math
+import time
+import threading
+from collections import Counter
+
+
+class ProfilerBusyError(Exception):
+    """已有采样任务在运行"""
+    pass
+
+
+class SamplingProfiler:
+    """基于 sys._current_frames() 的采样分析器
+
+    在调用线程中按固定间隔采集进程内所有其他线程的调用栈，并按栈聚合计数，
+    无需重启服务即可分析线上热点路径。同一时间只允许一个采样任务运行。
+    """
+
+    def __init__(self, max_seconds=60):
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _format_stack(frame):
+        """将调用栈格式化为从外到内、以分号分隔的字符串"""
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        frames.reverse()
+        return ";".join(frames)
+
+    def run(self, seconds, interval=0.005):
+        """采样指定的时长
+
+        参数:
+            seconds (float): 采样时长（秒），不超过 max_seconds
+            interval (float): 采样间隔（秒），限制在1毫秒到采样时长之间
+
+        返回:
+            dict: 包含采样次数、实际时长和聚合后的调用栈计数
+
+        异常:
+            ValueError: 采样时长或间隔不是有限数值
+            ProfilerBusyError: 已有采样任务在运行
+        """
+        seconds, interval = float(seconds), float(interval)
+        if not (math.isfinite(seconds) and math.isfinite(interval)):
+            raise ValueError("采样时长和间隔必须是有限数值")
+        seconds = min(max(seconds, 0.1), self.max_seconds)
+        interval = min(max(interval, 0.001), seconds)
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError("已有采样任务在运行")
+        try:
+            own_id = threading.get_ident()
+            thread_names = {t.ident: t.name for t in threading.enumerate()}
+            stacks = Counter()
+            samples = 0
+            started = time.monotonic()
+            deadline = started + seconds
+            while time.monotonic() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_id:
+                        continue
+                    thread_name = thread_names.get(thread_id)
+                    if thread_name is None:
+                        thread_names = {t.ident: t.name for t in threading.enumerate()}
+                        thread_name = thread_names.get(thread_id, str(thread_id))
+                    stacks[f"{thread_name};{self._format_stack(frame)}"] += 1
+                samples += 1
+                time.sleep(interval)
+            return {
+                "samples": samples,
+                "duration": round(time.monotonic() - started, 3),
+                "interval": interval,
+                "stacks": stacks,
+            }
+        finally:
+            self._lock.release()
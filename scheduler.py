@@ -0,0 +1,256 @@
+import time
+import threading
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from tracing import record_span
+# 导入日志配置
+from logger_config import logger
+
+# 优先级类别（按优先级从高到低排列）
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+PRIORITY_SAMPLE = "sample"
+PRIORITY_CLASSES = (PRIORITY_INTERACTIVE, PRIORITY_BATCH, PRIORITY_SAMPLE)
+
+
+class SchedulerTimeoutError(Exception):
+    """排队等待超时异常"""
+    pass
+
+
+class _Ticket:
+    """一个排队中的合成请求"""
+
+    def __init__(self, priority, api_key):
+        self.priority = priority
+        self.api_key = api_key
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+
+
+class _PriorityClass:
+    """单个优先级类别的排队状态
+
+    每个API密钥拥有独立的FIFO队列，类别内部按"已服务量/权重"的虚拟时间
+    选择下一个密钥，实现按密钥的加权公平共享。
+    """
+
+    def __init__(self, name, window_size):
+        self.name = name
+        # api_key -> deque[_Ticket]，OrderedDict保证虚拟时间相同时按到达顺序轮转
+        self.queues = OrderedDict()
+        # api_key -> 虚拟时间（已服务请求数 / 权重），只保留有排队请求的密钥
+        self.virtual_time = {}
+        self.in_flight = 0
+        self.served = 0
+        self.timeouts = 0
+        self.recent_waits = deque(maxlen=window_size)
+
+    def depth(self):
+        return sum(len(q) for q in self.queues.values())
+
+    def oldest(self):
+        """返回本类别中等待时间最长的请求"""
+        heads = [q[0] for q in self.queues.values() if q]
+        if not heads:
+            return None
+        return min(heads, key=lambda t: t.enqueued_at)
+
+    def enqueue(self, ticket):
+        if ticket.api_key not in self.queues:
+            # 新激活的密钥从当前最小虚拟时间开始计算，避免空闲期积累额度后突发占用
+            active = [self.virtual_time[k] for k in self.queues]
+            self.virtual_time[ticket.api_key] = min(active) if active else 0.0
+            self.queues[ticket.api_key] = deque()
+        self.queues[ticket.api_key].append(ticket)
+
+    def remove(self, ticket):
+        queue = self.queues.get(ticket.api_key)
+        if queue is None:
+            return
+        try:
+            queue.remove(ticket)
+        except ValueError:
+            return
+        if not queue:
+            self._deactivate(ticket.api_key)
+
+    def pop_fair(self, weight_of):
+        """按加权公平规则弹出下一个请求"""
+        api_key = min(self.queues, key=lambda k: self.virtual_time[k])
+        return self._pop_from(api_key, weight_of)
+
+    def pop_oldest(self, weight_of):
+        """弹出等待时间最长的请求（用于防饥饿）"""
+        ticket = self.oldest()
+        return self._pop_from(ticket.api_key, weight_of)
+
+    def _pop_from(self, api_key, weight_of):
+        queue = self.queues[api_key]
+        ticket = queue.popleft()
+        self.virtual_time[api_key] += 1.0 / weight_of(api_key)
+        if not queue:
+            self._deactivate(api_key)
+        return ticket
+
+    def _deactivate(self, api_key):
+        """密钥的队列为空时移除其状态，重新激活时按当前最小虚拟时间重新计算"""
+        del self.queues[api_key]
+        del self.virtual_time[api_key]
+
+
+class RequestScheduler:
+    """语音合成请求调度器
+
+    限制同时进行的上游合成数量，并按优先级类别分配空闲槽位：
+    - interactive: /api/tts、/api/tts/stream 等交互式请求
+    - batch: /api/tts/batch 批量请求
+    - sample: 语音样本/预热请求
+
+    类别之间按严格优先级调度，类别内部按API密钥加权公平共享；
+    当低优先级请求等待超过 starvation_timeout 秒时会被提前调度，防止饿死。
+    """
+
+    def __init__(self, max_concurrent=4, starvation_timeout=10.0, key_weights=None,
+                 queue_timeout=None, window_size=500):
+        """初始化调度器
+
+        参数:
+            max_concurrent (int): 同时进行的合成数量上限
+            starvation_timeout (float): 低优先级请求的最长等待时间（秒），超过后优先调度
+            key_weights (dict): 密钥（客户端标识）权重，未配置的密钥权重为1
+            queue_timeout (float): 排队超时时间（秒），None表示不超时
+            window_size (int): 统计等待时间时保留的最近样本数
+        """
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.starvation_timeout = starvation_timeout
+        self.key_weights = dict(key_weights or {})
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._running = 0
+        self._classes = {name: _PriorityClass(name, window_size) for name in PRIORITY_CLASSES}
+
+    def _weight_of(self, api_key):
+        weight = self.key_weights.get(api_key, 1.0)
+        return weight if weight > 0 else 1.0
+
+    def _select_next(self):
+        """选择下一个获得槽位的请求，调用方需持有锁"""
+        now = time.monotonic()
+        # 防饥饿：优先调度等待超时的请求中等待最久的一个
+        if self.starvation_timeout is not None:
+            starving = []
+            for pclass in self._classes.values():
+                oldest = pclass.oldest()
+                if oldest and now - oldest.enqueued_at >= self.starvation_timeout:
+                    starving.append((oldest.enqueued_at, pclass))
+            if starving:
+                _, pclass = min(starving, key=lambda item: item[0])
+                return pclass.pop_oldest(self._weight_of)
+        # 严格优先级 + 类别内加权公平
+        for name in PRIORITY_CLASSES:
+            pclass = self._classes[name]
+            if pclass.queues:
+                return pclass.pop_fair(self._weight_of)
+        return None
+
+    def _dispatch(self):
+        """在有空闲槽位时唤醒排队中的请求，调用方需持有锁"""
+        dispatched = False
+        while self._running < self.max_concurrent:
+            ticket = self._select_next()
+            if ticket is None:
+                break
+            ticket.granted = True
+            self._running += 1
+            dispatched = True
+        if dispatched:
+            self._cond.notify_all()
+
+    def acquire(self, priority=PRIORITY_INTERACTIVE, api_key=None, timeout=None):
+        """申请一个合成槽位，阻塞直到获得槽位
+
+        参数:
+            priority (str): 优先级类别
+            api_key (str): 请求所属的客户端标识（API密钥或客户端地址），用于类别内的公平共享
+            timeout (float): 排队超时时间（秒），默认使用调度器配置
+
+        返回:
+            float: 排队等待时间（秒）
+
+        异常:
+            SchedulerTimeoutError: 排队超时
+        """
+        if priority not in self._classes:
+            raise ValueError(f"未知的优先级类别: {priority}")
+        if timeout is None:
+            timeout = self.queue_timeout
+        pclass = self._classes[priority]
+        ticket = _Ticket(priority, api_key or "anonymous")
+
+        with self._cond:
+            pclass.enqueue(ticket)
+            self._dispatch()
+            deadline = None if timeout is None else ticket.enqueued_at + timeout
+            while not ticket.granted:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    pclass.remove(ticket)
+                    pclass.timeouts += 1
+                    logger.warning(f"调度排队超时: 类别={priority}, 等待={timeout}秒")
+                    raise SchedulerTimeoutError(f"排队等待超时（{timeout}秒）")
+                self._cond.wait(remaining)
+
+            wait_time = time.monotonic() - ticket.enqueued_at
+            pclass.in_flight += 1
+            pclass.served += 1
+            pclass.recent_waits.append(wait_time)
+        record_span("queue_wait", wait_time)
+        if wait_time > 1:
+            logger.info(f"调度排队完成: 类别={priority}, 等待={wait_time:.3f}秒")
+        return wait_time
+
+    def release(self, priority=PRIORITY_INTERACTIVE):
+        """释放一个合成槽位"""
+        with self._cond:
+            self._running -= 1
+            self._classes[priority].in_flight -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, priority=PRIORITY_INTERACTIVE, api_key=None, timeout=None):
+        """以上下文管理器的方式占用一个合成槽位"""
+        self.acquire(priority, api_key, timeout)
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+    def get_stats(self):
+        """获取调度器统计信息
+
+        返回:
+            dict: 总体并发情况及每个优先级类别的队列深度和等待时间
+        """
+        now = time.monotonic()
+        with self._cond:
+            classes = {}
+            for name, pclass in self._classes.items():
+                waits = sorted(pclass.recent_waits)
+                oldest = pclass.oldest()
+                classes[name] = {
+                    "queue_depth": pclass.depth(),
+                    "in_flight": pclass.in_flight,
+                    "served": pclass.served,
+                    "timeouts": pclass.timeouts,
+                    "active_keys": len(pclass.queues),
+                    "oldest_wait_ms": round((now - oldest.enqueued_at) * 1000, 1) if oldest else 0.0,
+                    "avg_wait_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+                    "p95_wait_ms": round(waits[int(len(waits) * 0.95)] * 1000, 1) if waits else 0.0,
+                    "max_wait_ms": round(waits[-1] * 1000, 1) if waits else 0.0,
+                }
+            return {
+                "max_concurrent": self.max_concurrent,
+                "running": self._running,
+                "classes": classes,
+            }
@@ -0,0 +1,204 @@
+import os
+# 导入日志配置
+from logger_config import tts_logger
+
+# 尝试导入boto3（S3兼容存储后端需要）
+try:
+    import boto3
+    BOTO3_INSTALLED = True
+except ImportError:
+    BOTO3_INSTALLED = False
+
+
+class AudioStorage:
+    """音频存储后端基类
+
+    TTSService 通过 open_writer 边合成边写入音频，接口层通过 local_path / get_url
+    决定直接返回本地文件还是重定向到存储服务。
+    """
+
+    def open_writer(self, file_name):
+        """打开一个写入器，返回的对象支持 write(data)、close() 和 abort()"""
+        raise NotImplementedError
+
+    def local_path(self, file_name):
+        """返回本地文件路径，非本地存储返回None"""
+        return None
+
+    def public_url(self, file_name):
+        """返回长期有效的公开访问地址，没有时返回None（由接口层生成访问地址）"""
+        return None
+
+    def get_url(self, file_name):
+        """返回可直接下载音频的地址（可能是有时效的预签名地址），用于重定向"""
+        return None
+
+    def exists(self, file_name):
+        """判断音频文件是否存在"""
+        raise NotImplementedError
+
+
+class _LocalWriter:
+    """本地文件写入器"""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._file = open(file_path, "wb")
+
+    def write(self, data):
+        self._file.write(data)
+
+    def close(self):
+        self._file.close()
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self.file_path)
+        except OSError:
+            pass
+
+
+class LocalStorage(AudioStorage):
+    """本地文件系统存储"""
+
+    def __init__(self, directory="output"):
+        self.directory = directory
+        # 确保输出目录存在
+        if not os.path.exists(self.directory):
+            try:
+                os.makedirs(self.directory)
+                tts_logger.info(f"创建输出目录: {self.directory}")
+            except Exception as e:
+                tts_logger.error(f"创建输出目录失败: {str(e)}")
+                raise
+
+    def open_writer(self, file_name):
+        return _LocalWriter(self.local_path(file_name))
+
+    def local_path(self, file_name):
+        return os.path.join(self.directory, file_name)
+
+    def exists(self, file_name):
+        return os.path.isfile(self.local_path(file_name))
+
+
+class _S3MultipartWriter:
+    """S3分片上传写入器
+
+    数据累积到 part_size 后立即上传一个分片，合成进行中即可开始上传；
+    总大小不足一个分片时在关闭时用一次 put_object 上传。
+    """
+
+    def __init__(self, client, bucket, key, part_size, content_type):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.content_type = content_type
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []
+
+    def _upload_part(self):
+        if self._upload_id is None:
+            response = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType=self.content_type)
+            self._upload_id = response["UploadId"]
+        part_number = len(self._parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+            PartNumber=part_number, Body=bytes(self._buffer))
+        self._parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+        self._buffer.clear()
+
+    def write(self, data):
+        self._buffer.extend(data)
+        if len(self._buffer) >= self.part_size:
+            self._upload_part()
+
+    def close(self):
+        if self._upload_id is None:
+            self.client.put_object(
+                Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer), ContentType=self.content_type)
+            return
+        if self._buffer:
+            self._upload_part()
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+            MultipartUpload={"Parts": self._parts})
+
+    def abort(self):
+        if self._upload_id is None:
+            return
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+        except Exception as e:
+            tts_logger.warning(f"取消分片上传失败: {self.key}, 错误: {str(e)}")
+
+
+class S3Storage(AudioStorage):
+    """S3兼容对象存储（AWS S3、MinIO等）
+
+    音频在合成过程中以分片方式流式上传，访问时重定向到预签名地址或公开地址，
+    应用进程无需转发音频数据。
+    """
+
+    # S3要求除最后一个分片外每个分片至少5MB
+    MIN_PART_SIZE = 5 * 1024 * 1024
+
+    def __init__(self, bucket, prefix="", endpoint_url=None, region=None, access_key=None,
+                 secret_key=None, url_expires=3600, public_base_url=None, part_size=MIN_PART_SIZE):
+        """初始化S3存储
+
+        参数:
+            bucket (str): 存储桶名称
+            prefix (str): 对象键前缀
+            endpoint_url (str): 自定义服务地址（MinIO等S3兼容服务）
+            region (str): 区域
+            access_key (str): 访问密钥ID
+            secret_key (str): 访问密钥
+            url_expires (int): 预签名地址有效期（秒）
+            public_base_url (str): 公开访问地址前缀，配置后直接返回公开地址
+            part_size (int): 分片大小（字节），不小于5MB
+        """
+        if not BOTO3_INSTALLED:
+            raise RuntimeError("使用S3存储需要安装boto3: pip install boto3")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.url_expires = url_expires
+        self.public_base_url = public_base_url.rstrip("/") if public_base_url else None
+        self.part_size = max(int(part_size), self.MIN_PART_SIZE)
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key
+        )
+        tts_logger.info(f"使用S3存储: 存储桶={bucket}, 服务地址={endpoint_url or '默认'}")
+
+    def _key(self, file_name):
+        return f"{self.prefix}/{file_name}" if self.prefix else file_name
+
+    def open_writer(self, file_name):
+        return _S3MultipartWriter(self.client, self.bucket, self._key(file_name), self.part_size, "audio/mpeg")
+
+    def public_url(self, file_name):
+        if self.public_base_url:
+            return f"{self.public_base_url}/{self._key(file_name)}"
+        return None
+
+    def get_url(self, file_name):
+        return self.public_url(file_name) or self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self._key(file_name)},
+            ExpiresIn=self.url_expires
+        )
+
+    def exists(self, file_name):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(file_name))
+            return True
+        except Exception:
+            return False
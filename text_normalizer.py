@@ -0,0 +1,125 @@
+import re
+import unicodedata
+from functools import lru_cache
+
+
+class TextValidationError(ValueError):
+    """文本预处理后无法合成（为空或超长）"""
+    pass
+
+
+# 英文月份名称，用于英文日期朗读
+_EN_MONTHS = ["January", "February", "March", "April", "May", "June", "July",
+              "August", "September", "October", "November", "December"]
+
+# 日期：2024-07-01、2024/7/1、2024.7.1
+_DATE_PATTERN = re.compile(r"(?<!\d)(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})(?!\d)")
+# 时间：14:30、9:05:30
+_TIME_PATTERN = re.compile(r"(?<![\d:])(\d{1,2}):(\d{2})(?::(\d{2}))?(?![\d:])")
+# 负号单独捕获，紧跟在数字或英文字母后的"-"是连字符或范围（如5-10%），不视为负号
+_SIGN = r"(?:(?<![0-9A-Za-z.])(-))?"
+# 百分数：50%、-3.5%
+_PERCENT_PATTERN = re.compile(_SIGN + r"(\d+(?:\.\d+)?)\s*%")
+# 温度：25°C、-3 °F
+_TEMPERATURE_PATTERN = re.compile(_SIGN + r"(\d+(?:\.\d+)?)\s*°\s*([CF])")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# 按语言区域划分的数字/日期朗读规则
+_LOCALE_RULES = {
+    "zh": [
+        (_DATE_PATTERN, lambda m: f"{m.group(1)}年{int(m.group(2))}月{int(m.group(3))}日"),
+        (_TIME_PATTERN, lambda m: f"{int(m.group(1))}点" + (f"{int(m.group(2))}分" if int(m.group(2)) else "整")
+                                  + (f"{int(m.group(3))}秒" if m.group(3) and int(m.group(3)) else "")),
+        (_PERCENT_PATTERN, lambda m: f"{'负' if m.group(1) else ''}百分之{m.group(2)}"),
+        (_TEMPERATURE_PATTERN, lambda m: f"{'零下' if m.group(1) else ''}{m.group(2)}"
+                                         f"{'摄氏度' if m.group(3) == 'C' else '华氏度'}"),
+    ],
+    "en": [
+        (_DATE_PATTERN, lambda m: (f"{_EN_MONTHS[int(m.group(2)) - 1]} {int(m.group(3))}, {m.group(1)}"
+                                   if 1 <= int(m.group(2)) <= 12 else m.group(0))),
+        (_PERCENT_PATTERN, lambda m: f"{'minus ' if m.group(1) else ''}{m.group(2)} percent"),
+        (_TEMPERATURE_PATTERN, lambda m: f"{'minus ' if m.group(1) else ''}{m.group(2)} degrees "
+                                         f"{'Celsius' if m.group(3) == 'C' else 'Fahrenheit'}"),
+        (re.compile(r"\s*&\s*"), lambda m: " and "),
+    ],
+}
+# 使用中文规则的其他汉语语言代码
+_LOCALE_ALIASES = {"wuu": "zh", "yue": "zh"}
+
+
+def _is_speakable(char):
+    """判断字符是否可以朗读（过滤emoji、控制字符、格式字符、私有区字符等）"""
+    category = unicodedata.category(char)
+    if category in ("Cc", "Cf", "Co", "Cs", "Cn", "So"):
+        return False
+    code = ord(char)
+    # 变体选择符和emoji肤色修饰符
+    if 0xFE00 <= code <= 0xFE0F or 0x1F3FB <= code <= 0x1F3FF:
+        return False
+    return True
+
+
+class TextNormalizer:
+    """文本预处理器
+
+    在调用上游之前对文本做规范化：Unicode NFKC规范化（统一全角/半角）、
+    按语言区域的日期/时间/百分数/温度朗读规则、去除无法朗读的字符、合并空白，
+    并校验长度。结果缓存在有界LRU中，规范化后的文本同时作为缓存和去重的键。
+    """
+
+    def __init__(self, max_length=10000, cache_size=1024):
+        """初始化文本预处理器
+
+        参数:
+            max_length (int): 规范化后允许的最大字符数
+            cache_size (int): LRU缓存的最大条目数
+        """
+        self.max_length = max_length
+        self._normalize_cached = lru_cache(maxsize=cache_size)(self._normalize)
+
+    @staticmethod
+    def locale_of(voice):
+        """从语音模型名称（如zh-CN-YunxiNeural）中取语言代码"""
+        language = (voice or "").split("-")[0].lower()
+        return _LOCALE_ALIASES.get(language, language)
+
+    @staticmethod
+    def _normalize(text, locale):
+        text = unicodedata.normalize("NFKC", text)
+        # 换行、制表符等控制字符按空白处理
+        text = _WHITESPACE_PATTERN.sub(" ", text)
+        for pattern, replacement in _LOCALE_RULES.get(locale, []):
+            text = pattern.sub(replacement, text)
+        text = "".join(char for char in text if _is_speakable(char))
+        return _WHITESPACE_PATTERN.sub(" ", text).strip()
+
+    def normalize(self, text, voice):
+        """规范化文本并校验
+
+        参数:
+            text (str): 原始文本
+            voice (str): 语音模型名称，用于选择朗读规则
+
+        返回:
+            str: 规范化后的文本
+
+        异常:
+            TextValidationError: 文本为空或超过最大长度
+        """
+        # 明显超长的文本不做规范化，避免占用缓存
+        if len(text) > self.max_length * 4:
+            raise TextValidationError(f"文本过长: {len(text)}字符，最多{self.max_length}字符")
+        normalized = self._normalize_cached(text, self.locale_of(voice))
+        if not normalized:
+            raise TextValidationError("文本不能为空（去除无法朗读的字符后）")
+        if len(normalized) > self.max_length:
+            raise TextValidationError(f"文本过长: {len(normalized)}字符，最多{self.max_length}字符")
+        return normalized
+
+    def canonical_key(self, text, voice, rate):
+        """计算用于缓存和去重的键：(规范化文本, 语音模型, 语速)"""
+        return (self.normalize(text, voice), voice, rate)
+
+    def cache_info(self):
+        """获取LRU缓存统计信息"""
+        return self._normalize_cached.cache_info()._asdict()
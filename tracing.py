@@ -0,0 +1,114 @@
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# 当前请求的追踪对象，通过contextvars在同一请求的函数调用和异步任务之间传递
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """单个请求的阶段耗时记录"""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add_span(self, name, duration, start=None):
+        """记录一个阶段
+
+        参数:
+            name (str): 阶段名称
+            duration (float): 耗时（秒）
+            start (float): 阶段开始时间（perf_counter），默认按结束时间倒推
+        """
+        if start is None:
+            start = time.perf_counter() - duration
+        with self._lock:
+            self.spans.append((name, start - self.started, duration))
+
+    def elapsed(self):
+        """从请求开始到现在的耗时（秒）"""
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """生成Server-Timing响应头的值，同名阶段合并耗时"""
+        totals = {}
+        with self._lock:
+            for name, _, duration in self.spans:
+                total, count = totals.get(name, (0.0, 0))
+                totals[name] = (total + duration, count + 1)
+        metrics = []
+        for name, (total, count) in totals.items():
+            metric = f"{name};dur={total * 1000:.1f}"
+            if count > 1:
+                metric += f';desc="x{count}"'
+            metrics.append(metric)
+        metrics.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(metrics)
+
+    def to_record(self):
+        """生成用于写入追踪日志的记录"""
+        with self._lock:
+            spans = [
+                {"name": name, "start_ms": round(offset * 1000, 1), "dur_ms": round(duration * 1000, 1)}
+                for name, offset, duration in self.spans
+            ]
+        return {
+            "name": self.name,
+            "total_ms": round(self.elapsed() * 1000, 1),
+            "spans": spans,
+        }
+
+
+def start_trace(name):
+    """开始一个新的请求追踪
+
+    返回:
+        tuple: (Trace对象, 用于结束追踪的token)
+    """
+    trace = Trace(name)
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token):
+    """结束请求追踪，恢复之前的上下文"""
+    _current_trace.reset(token)
+
+
+def current_trace():
+    """获取当前上下文中的追踪对象，没有时返回None"""
+    return _current_trace.get()
+
+
+@contextmanager
+def use_trace(trace):
+    """在当前上下文中启用指定的追踪对象（用于流式响应生成器和工作线程）"""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(name):
+    """记录一个代码块的耗时，没有活动的追踪时不做任何事"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, time.perf_counter() - start, start)
+
+
+def record_span(name, duration):
+    """直接记录一个已知耗时的阶段（秒），没有活动的追踪时不做任何事"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(name, duration)
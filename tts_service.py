@@ -1,44 +1,45 @@
-import os
+import time
+import uuid
 import asyncio
-import edge_tts
 from datetime import datetime
+from engines import EdgeTTSEngine, EngineRouter
+from hedging import HedgePolicy
+from storage import LocalStorage
+from text_normalizer import TextNormalizer
+from tracing import span, record_span
 # 导入日志配置
 from logger_config import tts_logger, logger
 
 class TTSService:
-    def __init__(self):
-        """初始化TTS服务"""
-        # 确保输出目录存在
-        self.output_dir = "output"
-        if not os.path.exists(self.output_dir):
-            try:
-                os.makedirs(self.output_dir)
-                tts_logger.info(f"创建输出目录: {self.output_dir}")
-            except Exception as e:
-                tts_logger.error(f"创建输出目录失败: {str(e)}")
-                raise
+    def __init__(self, hedge_policy=None, storage=None, router=None, first_chunk_timeout=None, normalizer=None):
+        """初始化TTS服务
+        
+        参数:
+            hedge_policy (HedgePolicy): 上游对冲请求策略，默认不启用对冲
+            storage (AudioStorage): 音频存储后端，默认保存到本地output目录
+            router (EngineRouter): 合成引擎路由，默认只使用Edge-TTS引擎
+            first_chunk_timeout (float): 等待首个音频数据块的超时时间（秒），None表示不超时
+            normalizer (TextNormalizer): 文本预处理器，默认使用默认配置
+        """
+        self.hedge_policy = hedge_policy or HedgePolicy(enabled=False)
+        # 音频存储后端（本地存储会确保输出目录存在）
+        self.storage = storage or LocalStorage("output")
+        self.router = router or EngineRouter(EdgeTTSEngine())
+        self.first_chunk_timeout = first_chunk_timeout
+        self.normalizer = normalizer or TextNormalizer()
         
         # 不再硬编码语音列表，而是通过list_available_voices方法动态获取
         
     def list_available_voices(self):
-        """从Edge-TTS动态获取所有可用的语音模型
+        """从主合成引擎动态获取所有可用的语音模型
         
         返回:
             list: 语音模型名称列表
         """
         try:
             tts_logger.info("开始动态获取可用语音模型列表")
-            # 异步获取语音列表
-            voices = asyncio.run(edge_tts.list_voices())
-            
-            # 提取所有语音模型的ShortName
-            available_voices = []
-            for voice in voices:
-                if 'ShortName' in voice:
-                    voice_name = voice['ShortName']
-                    available_voices.append(voice_name)
-                    # 记录获取到的语音模型信息
-                    tts_logger.debug(f"发现语音模型: {voice_name}")
+            with span("list_voices"):
+                available_voices = self.router.primary.list_voices()
             
             tts_logger.info(f"成功获取语音模型列表，共 {len(available_voices)} 个模型")
             return available_voices
@@ -58,8 +59,15 @@ class TTSService:
             bool: 是否可用
         """
         try:
-            available_voices = self.list_available_voices()
-            result = voice in available_voices
+            with span("validate_voice"):
+                if self.router.is_offline_voice(voice):
+                    return True
+                available_voices = self.list_available_voices()
+                if not available_voices and self.router.fallback is not None:
+                    # 主引擎无法获取语音列表时，交由降级引擎合成
+                    tts_logger.warning(f"验证语音模型: 无法获取语音列表，{voice} 将由降级引擎合成")
+                    return True
+                result = voice in available_voices
             if not result:
                 tts_logger.warning(f"验证语音模型: {voice} 不可用")
             else:
@@ -69,35 +77,198 @@ class TTSService:
             tts_logger.error(f"验证语音模型时出错: {str(e)}")
             return False
     
-    async def generate_speech(self, text, voice="zh-CN-YunxiNeural", rate="+0%"):
+    def preprocess_text(self, text, voice):
+        """文本预处理：规范化并校验长度（结果有LRU缓存）
+        
+        参数:
+            text (str): 原始文本
+            voice (str): 语音模型名称，用于选择朗读规则
+        
+        返回:
+            str: 规范化后的文本
+        
+        异常:
+            TextValidationError: 文本为空或超过最大长度
+        """
+        with span("normalize"):
+            return self.normalizer.normalize(text, voice)
+    
+    def canonical_key(self, text, voice, rate):
+        """计算用于缓存和去重的键：(规范化文本, 语音模型, 语速)"""
+        return self.normalizer.canonical_key(text, voice, rate)
+    
+    @staticmethod
+    async def _next_chunk(stream):
+        """读取下一个音频数据块，流结束时返回None"""
+        try:
+            return await stream.__anext__()
+        except StopAsyncIteration:
+            return None
+    
+    @staticmethod
+    async def _discard(task, stream):
+        """取消一个未被采用的合成会话"""
+        task.cancel()
+        try:
+            await task
+        except BaseException:
+            pass
+        try:
+            await stream.aclose()
+        except Exception:
+            pass
+    
+    async def _open_stream(self, engine, text, voice, rate, hedge=True):
+        """打开合成会话并等待首个音频数据块，必要时发起对冲请求
+        
+        如果启用了对冲且在阈值时间内未收到首个音频数据块，则在预算允许时
+        发起第二个相同的会话，采用先返回音频的会话并取消另一个。
+        
+        参数:
+            engine (SynthesisEngine): 合成引擎
+            hedge (bool): 是否允许对冲（只对主引擎对冲）
+        
+        返回:
+            tuple: (采用的数据流, 首个数据块（无音频时为None）, 首块延迟秒数)
+        
+        异常:
+            asyncio.TimeoutError: 超过first_chunk_timeout仍未收到音频
+        """
+        policy = self.hedge_policy
+        if hedge:
+            policy.on_request()
+        started = time.monotonic()
+        deadline = started + self.first_chunk_timeout if self.first_chunk_timeout else None
+        hedge_at = started + policy.get_delay() if hedge and policy.enabled else None
+        primary = engine.stream(text, voice, rate)
+        pending = {asyncio.ensure_future(self._next_chunk(primary)): primary}
+        hedge_stream = None
+        winner = None
+        first_chunk = None
+        error = None
+        try:
+            while pending and winner is None:
+                now = time.monotonic()
+                waits = [at - now for at in (hedge_at, deadline) if at is not None]
+                timeout = max(0.0, min(waits)) if waits else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    now = time.monotonic()
+                    if deadline is not None and now >= deadline:
+                        raise asyncio.TimeoutError(f"{engine.name} {self.first_chunk_timeout} 秒内未返回音频")
+                    if hedge_at is not None and now >= hedge_at:
+                        # 超过阈值仍未收到首个数据块，在预算允许时发起对冲请求
+                        hedge_at = None
+                        if policy.try_hedge():
+                            tts_logger.warning(f"上游 {(now - started):.3f} 秒未返回音频，发起对冲请求: 语音模型={voice}")
+                            hedge_stream = engine.stream(text, voice, rate)
+                            pending[asyncio.ensure_future(self._next_chunk(hedge_stream))] = hedge_stream
+                    continue
+                for task in done:
+                    stream = pending.pop(task)
+                    if task.exception() is not None:
+                        # 其中一个会话失败时，继续等待另一个会话
+                        error = task.exception()
+                        await self._discard(task, stream)
+                        continue
+                    winner = stream
+                    first_chunk = task.result()
+                    break
+        finally:
+            for task, stream in pending.items():
+                await self._discard(task, stream)
+        
+        if winner is None:
+            raise error
+        
+        first_chunk_latency = time.monotonic() - started
+        if hedge:
+            hedged_won = hedge_stream is not None and winner is hedge_stream
+            policy.record_first_chunk(first_chunk_latency, hedged_won)
+            if hedged_won:
+                tts_logger.info(f"对冲请求先返回音频: 语音模型={voice}")
+        record_span("upstream_first_chunk", first_chunk_latency)
+        return winner, first_chunk, first_chunk_latency
+    
+    async def _audio_stream(self, text, voice, rate):
+        """获取语音数据流
+        
+        由引擎路由选择合成引擎；主引擎在返回首个音频数据块前失败或超时时，
+        如果配置了降级引擎则改用降级引擎重新合成。
+        
+        生成:
+            bytes: 语音数据块
+        """
+        engine = self.router.select(voice)
+        started = time.monotonic()
+        try:
+            stream, first_chunk, latency = await self._open_stream(
+                engine, text, voice, rate, hedge=engine is self.router.primary)
+            self.router.record(engine, latency, True)
+        except Exception as e:
+            self.router.record(engine, time.monotonic() - started, False)
+            fallback = self.router.fallback_for(engine)
+            if fallback is None:
+                raise
+            tts_logger.warning(f"{engine.name} 合成失败，改用降级引擎 {fallback.name}: {str(e)}")
+            engine = fallback
+            stream, first_chunk, _ = await self._open_stream(engine, text, voice, rate, hedge=False)
+        
+        if engine is not self.router.primary:
+            tts_logger.info(f"使用降级引擎合成: {engine.name}, 语音模型={voice}")
+        try:
+            if first_chunk is not None:
+                yield first_chunk
+                async for data in stream:
+                    yield data
+        finally:
+            await stream.aclose()
+            record_span("upstream_stream", time.monotonic() - started)
+    
+    async def generate_speech(self, text, voice="zh-CN-YunxiNeural", rate="+0%", normalized=False):
         """异步生成语音文件
         
         参数:
             text (str): 要转换为语音的文本
             voice (str): 语音模型名称
             rate (str): 语速，格式为"+/-数字%"
+            normalized (bool): 文本是否已经过 preprocess_text 预处理，是则不再重复预处理
         
         返回:
-            dict: 生成结果，包含success、message、file_name、file_path等字段
+            dict: 生成结果，包含success、message、file_name、file_path等字段，
+                非本地存储时file_path为None
         """
         try:
             # 生成唯一的文件名
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-            file_name = f"tts_{timestamp}.mp3"
-            file_path = os.path.join(self.output_dir, file_name)
+            # 附加随机后缀，避免并发生成时同一微秒内文件名冲突
+            file_name = f"tts_{timestamp}_{uuid.uuid4().hex[:8]}.mp3"
+            file_path = self.storage.local_path(file_name)
             
             tts_logger.info(f"开始生成语音: 语音模型={voice}, 语速={rate}, 文本长度={len(text)}字符")
             
-            # 创建TTS引擎
-            communicate = edge_tts.Communicate(text, voice, rate=rate)
+            # 文本预处理，无法合成的文本在调用上游前即返回失败
+            if not normalized:
+                text = self.preprocess_text(text, voice)
             
-            # 生成并保存语音文件
-            with open(file_path, "wb") as file:
-                async for chunk in communicate.stream():
-                    if chunk["type"] == "audio":
-                        file.write(chunk["data"])
+            # 边合成边写入存储，同时统计写入耗时
+            write_time = 0.0
+            writer = self.storage.open_writer(file_name)
+            try:
+                async for data in self._audio_stream(text, voice, rate):
+                    write_started = time.perf_counter()
+                    writer.write(data)
+                    write_time += time.perf_counter() - write_started
+                write_started = time.perf_counter()
+                writer.close()
+                write_time += time.perf_counter() - write_started
+            except BaseException:
+                # 合成失败时丢弃已写入的部分数据
+                writer.abort()
+                raise
+            record_span("file_write", write_time)
             
-            tts_logger.info(f"语音生成成功: {file_name}, 保存路径: {file_path}")
+            tts_logger.info(f"语音生成成功: {file_name}, 保存路径: {file_path or '远程存储'}")
             
             return {
                 "success": True,
@@ -113,39 +284,27 @@ class TTSService:
                 "message": error_msg
             }
     
-    def generate_speech_sync(self, text, voice="zh-CN-YunxiNeural", rate="+0%"):
+    def generate_speech_sync(self, text, voice="zh-CN-YunxiNeural", rate="+0%", normalized=False):
         """同步生成语音文件
         
         参数:
             text (str): 要转换为语音的文本
             voice (str): 语音模型名称
             rate (str): 语速，格式为"+/-数字%"
+            normalized (bool): 文本是否已经过 preprocess_text 预处理
         
         返回:
             dict: 生成结果，包含success、message、file_name、file_path等字段
         """
         try:
             tts_logger.info("调用同步语音生成方法")
-            # 为每个线程创建一个新的事件循环（解决Flask多线程环境下的问题）
+            # 每次调用创建一个新的事件循环（解决Flask多线程及线程池复用线程时的问题）
+            loop = asyncio.new_event_loop()
             try:
-                # 尝试获取当前事件循环
-                loop = asyncio.get_event_loop()
-            except RuntimeError:
-                # 如果当前线程没有事件循环，则创建一个新的
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                
-            # 运行异步任务
-            if loop.is_running():
-                # 如果事件循环正在运行，使用create_task和run_coroutine_threadsafe
-                future = asyncio.run_coroutine_threadsafe(self.generate_speech(text, voice, rate), loop)
-                result = future.result()
-            else:
-                # 否则使用当前事件循环
-                result = loop.run_until_complete(self.generate_speech(text, voice, rate))
+                return loop.run_until_complete(self.generate_speech(text, voice, rate, normalized))
+            finally:
                 # 运行完成后关闭事件循环
                 loop.close()
-            return result
         except Exception as e:
             error_msg = f"同步语音生成失败: {str(e)}"
             tts_logger.error(error_msg)
@@ -154,13 +313,14 @@ class TTSService:
                 "message": error_msg
             }
     
-    async def generate_speech_stream(self, text, voice="zh-CN-YunxiNeural", rate="+0%"):
+    async def generate_speech_stream(self, text, voice="zh-CN-YunxiNeural", rate="+0%", normalized=False):
         """异步生成流式语音
         
         参数:
             text (str): 要转换为语音的文本
             voice (str): 语音模型名称
             rate (str): 语速，格式为"+/-数字%"
+            normalized (bool): 文本是否已经过 preprocess_text 预处理，是则不再重复预处理
         
         生成:
             bytes: 语音数据块
@@ -168,15 +328,15 @@ class TTSService:
         try:
             tts_logger.info(f"开始流式语音生成: 语音模型={voice}, 语速={rate}")
             
-            # 创建TTS引擎
-            communicate = edge_tts.Communicate(text, voice, rate=rate)
+            # 文本预处理，无法合成的文本在调用上游前即返回失败
+            if not normalized:
+                text = self.preprocess_text(text, voice)
             
             # 流式生成并返回语音数据
             chunk_count = 0
-            async for chunk in communicate.stream():
-                if chunk["type"] == "audio":
-                    chunk_count += 1
-                    yield chunk["data"]
+            async for data in self._audio_stream(text, voice, rate):
+                chunk_count += 1
+                yield data
             
             tts_logger.info(f"流式语音生成完成，共传输 {chunk_count} 个数据块")
         except Exception as e: